@@ -1,16 +1,118 @@
-import platform
+import csv
+import json
+import os
+import shutil
 import sqlite3
 import sys
-from collections import namedtuple
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
 from hashlib import sha256
-from itertools import product
+from itertools import groupby
 from pathlib import Path
 from uuid import uuid4
 
-import exif
 import yaml
 from openpyxl import Workbook, load_workbook
 
+from tract_cache import CACHE_DIR, metadata_cache
+
+INGEST_WORKERS = min(8, os.cpu_count() or 1)  # default ingest pool size
+INSERT_BATCH = 500  # rows per executemany() call
+PROGRESS_ROWS = 20_000  # report progress every this many rows
+STORE_SUFFIX = ".tract.db"  # working database beside the data file
+RECOVERY_FILES = 3  # autosave copies of the data file kept
+INDEXES = [  # (name, columns, unique) for imgdata
+    ("imgdata_observation_id", "observation_id", True),
+    ("imgdata_image_path", "image_path", False),
+    ("imgdata_group_id", "group_id", False),
+    ("imgdata_image_hash", "image_hash", False),
+    ("imgdata_image_epoch", "image_epoch, group_number", False),
+]
+INTERACTIVE_QUERIES = [  # per click / keystroke queries, see table_scans()
+    "select * from imgdata where observation_id = ?",
+    "select * from imgdata where observation_id in (?, ?)",
+    "select image_path from imgdata where observation_id = ?",
+    "update imgdata set (adults_n) = (?) where observation_id = ?",
+    "update imgdata set group_id = ? where observation_id = ?",
+    "select count(*) from imgdata where image_path = ?",
+    "select observation_id from imgdata where image_path = ? "
+    "order by group_number asc",
+    "select * from imgdata where group_id = ? order by image_epoch, group_number",
+    "select rowid, image_epoch, group_number, observation_status, observation_id "
+    "from imgdata where observation_id = ?",
+    "select observation_id from imgdata where group_id = ?",
+    "update imgdata set (entry_by) = (?) where image_epoch between ? and ?",
+    "select * from imgdata where image_hash = ?",
+]
+STORE_PRAGMAS = [
+    "journal_mode = wal",
+    "synchronous = normal",
+    "temp_store = memory",
+    "cache_size = -65536",  # KiB
+    "mmap_size = 268435456",
+]
+HASH_CHUNK = 1 << 20  # read / hash images in 1 MiB chunks
+EXIF_HEAD = 1 << 17  # APP1 segments are < 64 KiB, allow for APP0 etc. before it
+EXIF_TAGS = {  # EXIF tag id -> name used by the exif package
+    0x9003: "datetime_original",
+    0xA002: "pixel_x_dimension",
+    0xA003: "pixel_y_dimension",
+}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif"}  # lower case
+PRUNE_DIRS = {CACHE_DIR}  # folder names not searched for images
+RACY_NS = 2_000_000_000  # folders modified this recently are always re-listed
+SHADOW_COLUMNS = {  # working database only columns, not in the data file
+    "image_epoch": "integer",  # image_time as seconds since 1970, see image_epoch()
+}
+INGEST_FIELDS = [
+    "image_name",
+    "image_path",
+    "image_bytes",
+    "image_time",
+    "image_epoch",
+    "image_w",
+    "image_h",
+    "image_hash",
+    "observation_id",
+    "group_id",
+    "group_number",
+]
+
+
+EPOCH = datetime(1970, 1, 1)
+FolderDiff = namedtuple("FolderDiff", "added removed moved images records")
+GroupSuggestion = namedtuple("GroupSuggestion", "camera_deploy start end ids")
+GROUP_GAP = 60  # seconds between images that starts a new suggested group
+NO_CONTENT = ["no relevant content", "QA complete - no relevant content"]
+
+
+class Cancelled(Exception):
+    """Raised by a progress callback to stop a long operation.
+
+    Long operations take progress=None, a function called as progress(done,
+    total) as work is done, total is None if unknown.  Work already committed
+    is kept.
+    """
+
+
+class StoreConnection(sqlite3.Connection):
+    """Working database connection usable from a background job's thread.
+
+    transaction() holds lock, so statements from another thread don't join
+    a transaction they didn't start.  Writes that may run while a job is
+    running must therefore go through transaction() too.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.RLock()
+
 
 def named_tuples(cursor):
     Record = namedtuple("Record", [i[0] for i in cursor.description])
@@ -18,233 +120,1299 @@ def named_tuples(cursor):
 
 
 def create_data_file(path: str) -> None:
-    """Read tract_fields.yml and create a new workbook, *OVERWRITING* existing."""
-    fields = yaml.safe_load(Path(__file__).with_name("tract_fields.yml").open())
+    """Read tract_fields.yml and create a new workbook, *OVERWRITING* existing.
+
+    Creates a .csv or .jsonl file instead if path ends with that.
+    """
+    fields = schema().order
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        with open(path, "w", newline="", encoding="utf-8") as out:
+            csv.writer(out).writerow(fields)
+        return
+    if suffix == ".jsonl":  # no header, fields come from schema()
+        Path(path).write_text("")
+        return
     wb = Workbook()
     ws = wb.active
     ws.title = "ImageData"
-    for field_i, field in enumerate(fields["fields"]):
+    for field_i, field in enumerate(fields):
         ws.cell(0 + 1, field_i + 1, field)
     wb.save(path)
 
 
+@lru_cache(maxsize=None)
+def insert_sql(fields: tuple[str]) -> str:
+    return "insert into imgdata (%s)" % ",".join(fields) + "values (%s)" % ",".join(
+        "?" * len(fields)
+    )
+
+
+@lru_cache(maxsize=None)
+def update_sql(fields: tuple[str]) -> str:
+    return (
+        "update imgdata set (%s)" % ",".join(fields)
+        + "= (%s)" % ",".join("?" * len(fields))
+        + " where observation_id = ?"
+    )
+
+
 def insert_row(con, fields: list[str], row: list = None) -> None:
     if row is None:  # dict input
         row = list(fields.values())
         fields = list(fields)
-    sql = "insert into imgdata (%s)" % ",".join(fields) + "values (%s)" % ",".join(
-        "?" * len(fields)
-    )
-    con.execute(sql, row)
+    con.execute(insert_sql(tuple(fields)), row)
+
+
+def insert_rows(con, fields: list[str], rows) -> None:
+    """Insert an iterable of row sequences with one prepared statement."""
+    con.executemany(insert_sql(tuple(fields)), rows)
+
+
+@contextmanager
+def transaction(con):
+    """Run enclosed statements in one transaction, joining any already open."""
+    with getattr(con, "lock", nullcontext()):
+        if con.in_transaction:
+            yield con
+            return
+        con.execute("begin")
+        try:
+            yield con
+        except BaseException:
+            con.execute("rollback")
+            raise
+        con.execute("commit")
 
 
 def update_row(con, id_: str, fields: list[str], row: list = None) -> None:
     if row is None:  # dict input
         row = list(fields.values())
         fields = list(fields)
-    defs = field_defs()["fields"]
-    data = {k: v for k, v in zip(fields, row) if "clear_to" in defs[k]}
-    sql = (
-        "update imgdata set (%s)" % ",".join(data)
-        + "= (%s)" % ",".join("?" * len(data))
-        + " where observation_id = ?"
-    )
-    con.execute(sql, list(data.values()) + [id_])
+    clear_to = schema().clear_to
+    data = {k: v for k, v in zip(fields, row) if k in clear_to}
+    con.execute(update_sql(tuple(data)), list(data.values()) + [id_])
 
 
-def field_defs():
+def bulk_update(
+    con,
+    values: dict,
+    ids: list[str] = None,
+    group_id: str = None,
+    epochs: tuple[int, int] = None,
+    statuses: list[str] = None,
+) -> int:
+    """Set values on the records matching all the filters given, return count.
+
+    ids are observation_ids, epochs an inclusive (start, end) image_epoch
+    range, statuses observation_status values, None matching unset.  As for
+    update_row(), only fields with a clear_to value are set.  One UPDATE, in
+    one transaction.
+    """
+    clear_to = schema().clear_to
+    data = {k: v for k, v in values.items() if k in clear_to}
+    where, params = [], []
+    if group_id is not None:
+        where.append("group_id = ?")
+        params.append(group_id)
+    if epochs is not None:
+        where.append("image_epoch between ? and ?")
+        params.extend(epochs)
+    if statuses is not None:
+        clause = "observation_status in (%s)" % ",".join("?" * len(statuses))
+        if None in statuses:
+            clause = f"({clause} or observation_status is null)"
+        where.append(clause)
+        params.extend(statuses)
+    if ids is not None:
+        where.append("observation_id in (select observation_id from bulk_ids)")
+    elif not where:
+        raise ValueError("bulk_update() needs ids, group_id, epochs, or statuses")
+    if not data:
+        return 0
+    with transaction(con):
+        if ids is not None:
+            con.execute(
+                "create temp table if not exists bulk_ids "
+                "(observation_id text primary key)"
+            )
+            con.execute("delete from bulk_ids")
+            con.executemany(
+                "insert or ignore into bulk_ids values (?)", [[i] for i in ids]
+            )
+        res = con.execute(
+            "update imgdata set (%s) = (%s) where %s"
+            % (",".join(data), ",".join("?" * len(data)), " and ".join(where)),
+            list(data.values()) + params,
+        )
+    return res.rowcount
+
+
+class Schema:
+    """Compiled field definitions from tract_fields.yml, see schema().
+
+    Attributes are computed once per load: `fields` maps name to definition
+    (with "name" added), `order` is the column order, `types` the SQL type,
+    `coercers` convert text values to type, `clear_to` maps fields reset when
+    adding a group to their value, `copy` lists fields copied when linking
+    observations, `previous` dropdowns listing values already used, `inputs`
+    and `shown` the fields shown in the UI.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.mtime_ns = path.stat().st_mtime_ns
+        self.defs = yaml.safe_load(path.open())
+        self.fields = self.defs["fields"]
+        for k, v in self.fields.items():
+            v["name"] = k
+        self.order = list(self.fields)
+        self.types = {k: v.get("type", "text") for k, v in self.fields.items()}
+        self.coercers = {k: partial(coerce, v) for k, v in self.types.items()}
+        self.clear_to = {
+            k: v["clear_to"] for k, v in self.fields.items() if "clear_to" in v
+        }
+        self.copy = [k for k, v in self.fields.items() if v.get("copy")]
+        self.previous = [k for k, v in self.fields.items() if v.get("previous")]
+        self.inputs = [k for k, v in self.fields.items() if v.get("input")]
+        self.shown = [k for k, v in self.fields.items() if v.get("show")]
+        self.insert_sql = insert_sql(tuple(self.order))
+
+    def coercer(self, field: str):
+        """Function converting text to field's type, text for unknown fields."""
+        return self.coercers.get(field) or partial(coerce, "text")
+
+
+_schema = None
+
+
+def schema() -> Schema:
+    """The field definitions, reloaded only when tract_fields.yml changes."""
+    global _schema
     src = Path(sys.argv[0]).with_name("tract_fields.yml")
-    if src.exists():
-        print(f"\nUsing field definitions from local file {src}\n")
-    else:
-        print("\nUsing internal field definitions\n")
+    local = src.exists()
+    if not local:
         src = Path(__file__).with_name("tract_fields.yml")
-    defs = yaml.safe_load(src.open())
-    for k, v in defs["fields"].items():
-        v["name"] = k
-    return defs
+    if (
+        _schema is None
+        or _schema.path != src
+        or _schema.mtime_ns != src.stat().st_mtime_ns
+    ):
+        if local:
+            print(f"\nUsing field definitions from local file {src}\n")
+        else:
+            print("\nUsing internal field definitions\n")
+        _schema = Schema(src)
+    return _schema
 
 
-def xlsx_to_sqlite(xlsx_path: str, sqlite_path) -> object:
-    """Convert .xlsx to .db, *OVERWRITING* existing imgdata table."""
-    field_type = {k: v["type"] for k, v in field_defs()["fields"].items()}
-    wb = load_workbook(xlsx_path)
-    ws = wb.active
-    rows = iter(ws)
-    fields = [cell.value for cell in next(rows)]
+def field_defs():
+    return schema().defs
+
+
+def connect(sqlite_path) -> object:
+    """Connect to a working database, autocommit, see transaction()."""
+    con = sqlite3.connect(
+        sqlite_path,
+        isolation_level=None,
+        check_same_thread=False,
+        factory=StoreConnection,
+    )
+    for pragma in STORE_PRAGMAS:
+        con.execute("pragma " + pragma)
+    return con
+
+
+def store_path(data_path: str) -> str:
+    """Path of the working database kept beside data_path."""
+    return str(Path(data_path).with_suffix(STORE_SUFFIX))
+
+
+def fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def mark_clean(con, data_path: str, dirty: bool = False) -> None:
+    """Record that the working database matches the file data_path.
+
+    Triggers set the dirty flag on any later change to imgdata.  dirty is for
+    data_path saved from a snapshot() that's since been edited.
+    """
+    con.execute("create table if not exists tract_meta (key text primary key, value)")
+    for event in "insert", "update", "delete":
+        con.execute(
+            f"create trigger if not exists imgdata_dirty_{event} "
+            f"after {event} on imgdata "
+            "when (select value from tract_meta where key = 'dirty') = 0 "
+            "begin insert or replace into tract_meta values ('dirty', 1); end"
+        )
+    con.executemany(
+        "insert or replace into tract_meta values (?, ?)",
+        [("fingerprint", fingerprint(data_path)), ("dirty", int(dirty))],
+    )
+
+
+def open_store(data_path: str, persistent: bool = False) -> object:
+    """Connection to the working database for the data file data_path.
+
+    If persistent, the working database is the file store_path(data_path),
+    kept between sessions so edits aren't lost before data_path is saved.  It
+    is reused as long as data_path hasn't changed since it was imported or
+    saved, otherwise data_path is imported again, after backing up the
+    working database if it has unsaved edits.
+    """
+    if not persistent:
+        con = data_to_sqlite(data_path, ":memory:")
+        mark_clean(con, data_path)
+        return con
+    db_path = store_path(data_path)
+    if os.path.exists(db_path):
+        con = connect(db_path)
+        con.execute("create table if not exists tract_meta (key, value)")
+        meta = dict(con.execute("select key, value from tract_meta"))
+        if meta.get("fingerprint") == fingerprint(data_path):
+            print(f"Using working database {db_path}, {data_path} unchanged.")
+            index_store(con)  # for databases from older versions
+            return con
+        if meta.get("dirty"):
+            backup = sqlite3.connect(db_path + ".bak")
+            con.backup(backup)
+            backup.close()
+            print(f"{data_path} changed, unsaved edits kept in {db_path}.bak")
+        con.close()
+    con = data_to_sqlite(data_path, db_path)
+    mark_clean(con, data_path)
+    return con
+
+
+def snapshot(con) -> object:
+    """In memory copy of con's database, usable from another thread.
+
+    Waits for any open transaction(), so a job's changes aren't half copied.
+    """
+    copy = sqlite3.connect(":memory:", check_same_thread=False)
+    with getattr(con, "lock", nullcontext()):
+        con.backup(copy)
+    return copy
+
+
+def recovery_path(data_path: str, n: int = 1) -> str:
+    """Path of the n-th most recent recovery copy of data_path."""
+    path = Path(data_path)
+    return str(path.with_name(f"{path.stem}.recovery-{n}{path.suffix}"))
+
+
+def write_recovery(
+    con, data_path: str, basedir: str = None, fields: list[str] = None
+) -> str:
+    """Save con to a new recovery copy of data_path, keeping RECOVERY_FILES.
+
+    For autosave, con is normally a snapshot() being written by a worker
+    thread, so nothing is printed.
+    """
+    for n in range(RECOVERY_FILES - 1, 0, -1):
+        if os.path.exists(recovery_path(data_path, n)):
+            os.replace(recovery_path(data_path, n), recovery_path(data_path, n + 1))
+    path = recovery_path(data_path)
+    sqlite_to_data(con, path, basedir, fields)
+    return path
+
+
+def image_epoch(image_time) -> int:
+    """Seconds since 1970 for image_time, None if it can't be parsed.
+
+    image_time is "YYYY/MM/DD HH:MM:SS" with any separators, or a datetime,
+    and is treated as UTC so differences are always real seconds.
+    """
+    if isinstance(image_time, datetime):
+        image_time = image_time.isoformat(" ")
+    try:
+        return int(
+            (
+                datetime(
+                    int(image_time[0:4]),
+                    int(image_time[5:7]),
+                    int(image_time[8:10]),
+                    int(image_time[11:13] or 0),
+                    int(image_time[14:16] or 0),
+                    int(image_time[17:19] or 0),
+                )
+                - EPOCH
+            ).total_seconds()
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+def epoch_datetime(epoch: int) -> datetime:
+    """image_epoch() back to a naive datetime."""
+    return EPOCH + timedelta(seconds=epoch)
+
+
+def add_image_epoch(con) -> None:
+    """Add / fill the image_epoch column, after bulk loading, see index_store()."""
+    columns = [i[1] for i in con.execute("pragma table_info(imgdata)")]
+    if "image_epoch" not in columns:
+        con.execute("alter table imgdata add column image_epoch integer")
+    con.create_function("image_epoch", 1, image_epoch, deterministic=True)
+    con.execute(
+        "update imgdata set image_epoch = image_epoch(image_time) "
+        "where image_epoch is null and image_time is not null"
+    )
+
+
+def index_store(con) -> None:
+    """Fill shadow columns and create indexes after bulk loading imgdata."""
+    add_image_epoch(con)
+    create_indexes(con)
+
+
+def create_indexes(con) -> None:
+    """Create INDEXES on imgdata, after bulk loading so each is built once."""
+    for name, columns, unique in INDEXES:
+        sql = f"create %sindex if not exists {name} on imgdata ({columns})"
+        try:
+            con.execute(sql % ("unique " if unique else ""))
+        except sqlite3.IntegrityError:
+            print(f"Duplicate values in {columns}, index {name} is not unique.")
+            con.execute(sql % "")
+
+
+def table_scans(con) -> list[str]:
+    """Filtered INTERACTIVE_QUERIES whose query plan scans all of imgdata."""
+    scans = []
+    for sql in INTERACTIVE_QUERIES:
+        if " where " not in sql:  # reads every row anyway
+            continue
+        plan = con.execute("explain query plan " + sql, [None] * sql.count("?"))
+        for detail in (i[-1] for i in plan):
+            if detail.startswith("SCAN imgdata"):
+                scans.append(f"{sql}: {detail}")
+    return scans
+
+
+def data_to_sqlite(data_path: str, sqlite_path) -> object:
+    """Import the data file data_path, a .xlsx, .csv, or .jsonl file."""
+    return DATA_FORMATS[Path(data_path).suffix.lower()][0](data_path, sqlite_path)
+
+
+def sqlite_to_data(
+    con, data_path: str, basedir: str = None, fields: list[str] = None
+) -> None:
+    """Export to the data file data_path, a .xlsx, .csv, or .jsonl file."""
+    DATA_FORMATS[Path(data_path).suffix.lower()][1](con, data_path, basedir, fields)
+
+
+def data_fields(data_path: str) -> list[str]:
+    """Column names of the data file data_path, schema() order if none."""
+    suffix = Path(data_path).suffix.lower()
+    fields = []
+    if suffix == ".xlsx":
+        fields = xlsx_header(data_path)[1]
+    elif os.path.exists(data_path):
+        with open(data_path, newline="", encoding="utf-8-sig") as src:
+            if suffix == ".csv":
+                fields = next(csv.reader(src), [])
+            else:
+                fields = list(json.loads(next(src, "{}")))
+    return fields or schema().order
+
+
+def coerce(type_: str, value):
+    """Convert value read from text to field type type_ where possible."""
+    if value is None or value == "":
+        return None
+    if type_ in ("int", "integer") and isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                return value  # e.g. "N/A"
+            return int(value) if value.is_integer() else value
+    if type_ == "real" and isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def create_imgdata(con, fields: list[str]) -> None:
+    """Create an empty imgdata table with fields followed by other schema() ones."""
+    field_type = schema().types
     sql = [field + " " + field_type.get(field, "text") for field in fields]
     sql += [
         field + " " + field_type.get(field, "text")
         for field in field_type
         if field not in fields
     ]
+    sql += [k + " " + v for k, v in SHADOW_COLUMNS.items() if k not in fields]
     sql = "create table imgdata (\n" + ",\n".join(sql) + "\n)"
-    con = sqlite3.connect(sqlite_path)
     con.execute("drop table if exists imgdata")
     con.execute(sql)
-    for row in rows:
-        insert_row(con, fields, [i.value for i in row])
+
+
+def import_rows(con, fields: list[str], rows, source: str) -> int:
+    """Insert rows in INSERT_BATCH chunks in one transaction, return count.
+
+    Rows are padded / truncated to fields, blank rows are skipped.
+    """
+    width = len(fields)
+    count = 0
+    batch = []
+    with transaction(con):
+        for row in rows:
+            row = tuple(row[:width])
+            if all(i is None for i in row):  # blank line
+                continue
+            batch.append(row + (None,) * (width - len(row)))
+            if len(batch) >= INSERT_BATCH:
+                insert_rows(con, fields, batch)
+                count += len(batch)
+                batch = []
+                if count % PROGRESS_ROWS == 0:
+                    print(f"Read {count} rows.")
+        insert_rows(con, fields, batch)
+        count += len(batch)
+    print(f"Read {count} rows from {source}.")
+    return count
+
+
+@contextmanager
+def replacing(path: str):
+    """Yield a temporary path that replaces path when the block succeeds.
+
+    So an interrupted save leaves the old file intact.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        suffix=Path(path).suffix, prefix=".tract-", dir=Path(path).parent
+    )
+    os.close(fd)
+    try:
+        yield temp_path
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)  # mkstemp() files are private
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def export_query(con, fields: list[str], basedir: str = None) -> object:
+    """Cursor for fields from imgdata, image_path_full computed from basedir."""
+    columns = list(fields)
+    params = []
+    if basedir and "image_path_full" in fields:
+        columns[fields.index("image_path_full")] = "? || image_path"
+        params.append(os.path.join(basedir, ""))
+    return con.execute("select " + ",".join(columns) + " from imgdata", params)
+
+
+def xlsx_to_sqlite(xlsx_path: str, sqlite_path) -> object:
+    """Convert .xlsx to .db, *OVERWRITING* existing imgdata table.
+
+    The workbook is streamed in read-only mode and inserted in INSERT_BATCH
+    row chunks in one transaction, so memory use doesn't grow with row count.
+    """
+    wb = load_workbook(xlsx_path, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        fields = list(next(rows))
+        while fields and fields[-1] is None:  # trailing empty header cells
+            fields.pop()
+        con = connect(sqlite_path)
+        create_imgdata(con, fields)
+        import_rows(con, fields, rows, xlsx_path)
+    finally:
+        wb.close()
+    index_store(con)
     return con
 
 
-def sqlite_to_xlsx(con, xlsx_path: str) -> None:
-    wb = load_workbook(xlsx_path)
-    ws = wb.active
-    rows = iter(ws)
-    fields = [cell.value for cell in next(rows)]
-    ws.delete_rows(2, ws.max_row)
-    sql = "select " + ",".join(fields) + " from imgdata"
-    res = con.execute(sql)
-    for row in res:
+def csv_to_sqlite(csv_path: str, sqlite_path) -> object:
+    """Convert .csv to .db, *OVERWRITING* existing imgdata table.
+
+    Values are converted using the field types in tract_fields.yml.
+    """
+    with open(csv_path, newline="", encoding="utf-8-sig") as src:
+        rows = csv.reader(src)
+        fields = next(rows, [])
+        coercers = [schema().coercer(i) for i in fields]
+        con = connect(sqlite_path)
+        create_imgdata(con, fields)
+        import_rows(
+            con,
+            fields,
+            ([c(v) for c, v in zip(coercers, row)] for row in rows),
+            csv_path,
+        )
+    index_store(con)
+    return con
+
+
+def jsonl_to_sqlite(jsonl_path: str, sqlite_path) -> object:
+    """Convert .jsonl (one JSON object per line) to .db, *OVERWRITING* imgdata.
+
+    Columns are the keys of the first record, or schema() order if there are
+    no records.  Values are converted using the field types in tract_fields.yml.
+    """
+    fields = data_fields(jsonl_path)
+    coercers = [schema().coercer(i) for i in fields]
+    con = connect(sqlite_path)
+    create_imgdata(con, fields)
+    with open(jsonl_path, encoding="utf-8-sig") as src:
+        records = (json.loads(line) for line in src if line.strip())
+        import_rows(
+            con,
+            fields,
+            ([c(rec.get(f)) for c, f in zip(coercers, fields)] for rec in records),
+            jsonl_path,
+        )
+    index_store(con)
+    return con
+
+
+def xlsx_header(xlsx_path: str) -> tuple[str, list[str], list[str]]:
+    """(sheet title, column names, other sheet titles) of the workbook at xlsx_path."""
+    wb = load_workbook(xlsx_path, read_only=True)
+    try:
+        title = wb.active.title
+        fields = list(next(wb.active.iter_rows(max_row=1, values_only=True)))
+        others = [i for i in wb.sheetnames if i != title]
+    finally:
+        wb.close()
+    while fields and fields[-1] is None:  # trailing empty header cells
+        fields.pop()
+    return title, fields, others
+
+
+def sqlite_to_xlsx(
+    con, xlsx_path: str, basedir: str = None, fields: list[str] = None
+) -> None:
+    """Write imgdata to the columns of the existing workbook at xlsx_path.
+
+    Rows are streamed into a write-only workbook saved to a temporary file
+    that then replaces xlsx_path, so an interrupted save leaves the old file.
+    image_path_full is computed from basedir in the query, if given.  fields
+    are the columns to write instead of those in xlsx_path.  Only the data
+    sheet is written, if xlsx_path has others it's first copied to
+    <name>.sheets-backup.xlsx.
+    """
+    title = "ImageData"
+    if fields is None:
+        title, fields, others = xlsx_header(xlsx_path)
+        if others:
+            backup = Path(xlsx_path).with_suffix(".sheets-backup.xlsx")
+            shutil.copy2(xlsx_path, backup)
+            print(
+                f"Warning: saving keeps only sheet {title}, not {', '.join(others)}, "
+                f"{xlsx_path} copied to {backup} first."
+            )
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(fields)
+    for row in export_query(con, fields, basedir):
         ws.append(row)
-    wb.save(xlsx_path)
+    with replacing(xlsx_path) as temp_path:
+        wb.save(temp_path)
 
 
-def add_images(con, basedir: str, paths: list[str]) -> int:
-    for path in paths:
-        res = con.execute("select * from imgdata where image_path = ?", [path])
-        if list(res):
-            print(f"Skipping existing {path}.")
-            continue
-        fullpath = Path(basedir) / path
-        exif = read_exif(fullpath)
-        data = fullpath.read_bytes()
-        row = dict(
-            image_name=fullpath.name,
-            image_path=path,
-            image_bytes=len(data),
-            image_time=exif.get(
-                "datetime_original", "1970:01:01 00:00:00"
-            ).replace(":", "/", 2),
-            image_w=exif.get("pixel_x_dimension", 1000),
-            image_h=exif.get("pixel_y_dimension", 1000),
-            image_hash=sha256(data).hexdigest(),
-            observation_id=uuid4().hex,
-            group_id=uuid4().hex,
-            group_number=1,
-        )
-        insert_row(con, row)
+def sqlite_to_csv(
+    con, csv_path: str, basedir: str = None, fields: list[str] = None
+) -> None:
+    """Write imgdata to csv_path, columns as in the existing file by default."""
+    fields = fields or data_fields(csv_path)
+    with replacing(csv_path) as temp_path:
+        with open(temp_path, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out)
+            writer.writerow(fields)
+            writer.writerows(export_query(con, fields, basedir))
 
 
-def image_list(path: str) -> list[str]:
-    """List of images from path *and its subfolders*."""
+def sqlite_to_jsonl(
+    con, jsonl_path: str, basedir: str = None, fields: list[str] = None
+) -> None:
+    """Write imgdata to jsonl_path, one JSON object per row."""
+    fields = fields or data_fields(jsonl_path)
+    with replacing(jsonl_path) as temp_path:
+        with open(temp_path, "w", encoding="utf-8") as out:
+            for row in export_query(con, fields, basedir):
+                out.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+                out.write("\n")
 
-    if platform.system() == "Windows":
-        transforms = [lambda x: x]  # case insensitive filesystem
-    else:
-        transforms = (str.upper, str.lower, str.title)
 
-    image_paths = []
-    #  Iterate .jpg, .JPEG, .Png etc.
-    for transform, extension in product(transforms, ("jpg", "png", "jpeg", "gif")):
-        ext = transform(extension)
-        image_paths.extend(
-            [
-                str(i.resolve(strict=True).relative_to(path))
-                for i in Path(path).rglob(f"*.{ext}")
-            ]
+DATA_FORMATS = {  # suffix: (import, export)
+    ".xlsx": (xlsx_to_sqlite, sqlite_to_xlsx),
+    ".csv": (csv_to_sqlite, sqlite_to_csv),
+    ".jsonl": (jsonl_to_sqlite, sqlite_to_jsonl),
+}
+
+
+def write_tables(path: str, tables: list[tuple], suffix: str) -> None:
+    """Write two (title, header, rows) tables as report sheets.
+
+    .xlsx paths get one sheet per table, for .csv the second table is written
+    to <name>-<suffix>.csv beside path.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        paths = [path, path.with_name(f"{path.stem}-{suffix}.csv")]
+        for out_path, (_, header, rows) in zip(paths, tables):
+            with open(out_path, "w", newline="", encoding="utf-8") as out:
+                writer = csv.writer(out)
+                writer.writerow(header)
+                writer.writerows(rows)
+        return
+    wb = Workbook(write_only=True)
+    for title, header, rows in tables:
+        ws = wb.create_sheet(title)
+        ws.append(header)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+
+
+def image_record(path: str, meta: dict) -> dict:
+    """The image derived fields for path from its read_metadata() results."""
+    image_time = meta.get("datetime_original", "1970:01:01 00:00:00")
+    image_time = image_time.replace(":", "/", 2)
+    return dict(
+        image_name=Path(path).name,
+        image_path=path,
+        image_bytes=meta["image_bytes"],
+        image_time=image_time,
+        image_epoch=image_epoch(image_time),
+        image_w=meta.get("pixel_x_dimension", 1000),
+        image_h=meta.get("pixel_y_dimension", 1000),
+        image_hash=meta["image_hash"],
+    )
+
+
+def image_metadata(
+    basedir: str,
+    paths,
+    workers: int = None,
+    processes: bool = False,
+    cache=None,
+):
+    """Yield (path, read_metadata()) for each path, in order, from a worker pool.
+
+    Only a few items per worker are in flight at once, so paths can be a lazy
+    iterable and results start arriving before it's exhausted.  Images whose
+    size and mtime match an entry in cache (a tract_cache.MetadataCache) are
+    not read at all.
+    """
+    workers = workers or INGEST_WORKERS
+    pool = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+    pending = deque()
+
+    def result():
+        path, stat, future = pending.popleft()
+        meta = future.result()
+        if stat is not None:
+            cache.put(path, stat, meta)
+        return path, meta
+
+    try:
+        for path in paths:
+            fullpath = Path(basedir) / path
+            stat = meta = None
+            if cache is not None:
+                stat = fullpath.stat()
+                meta = cache.get(path, stat)
+            if meta is None:
+                future = pool.submit(read_metadata, fullpath)
+            else:
+                stat, future = None, Future()
+                future.set_result(meta)
+            pending.append((path, stat, future))
+            if len(pending) >= workers * 4:
+                yield result()
+        while pending:
+            yield result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def add_images(
+    con,
+    basedir: str,
+    paths,
+    workers: int = None,
+    processes: bool = False,
+    cache=None,
+    progress=None,
+) -> int:
+    """Add records for paths, reading images in parallel, return count added.
+
+    Records are committed in batches of INSERT_BATCH, see Cancelled.
+    """
+    existing = set(i[0] for i in con.execute("select image_path from imgdata"))
+    hashes = set(i[0] for i in con.execute("select image_hash from imgdata"))
+    skipped = []
+    duplicates = []  # same image_hash as an image already in data
+
+    def new_paths():
+        for path in paths:
+            if path in existing:
+                skipped.append(path)
+                continue
+            existing.add(path)
+            yield path
+
+    total = len(paths) if hasattr(paths, "__len__") else None
+    start = time.perf_counter()
+    added = done = 0
+    batch = []
+    with metadata_cache(basedir, cache) as cache:
+        for path, meta in image_metadata(
+            basedir, new_paths(), workers, processes, cache
+        ):
+            done += 1
+            if meta["image_hash"] in hashes:
+                duplicates.append(path)
+                continue
+            hashes.add(meta["image_hash"])
+            record = image_record(path, meta)
+            record.update(
+                observation_id=uuid4().hex, group_id=uuid4().hex, group_number=1
+            )
+            batch.append([record[i] for i in INGEST_FIELDS])
+            if len(batch) >= INSERT_BATCH:
+                with transaction(con):
+                    insert_rows(con, INGEST_FIELDS, batch)
+                added += len(batch)
+                batch = []
+            if progress:
+                progress(done + len(skipped), total)
+        with transaction(con):
+            insert_rows(con, INGEST_FIELDS, batch)
+        added += len(batch)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Added {added} images in {elapsed:.1f}s "
+        f"({added / max(elapsed, 1e-6):.1f} images/s)."
+    )
+    if skipped:
+        print(f"Skipped {len(skipped)} images already in data, e.g. {skipped[0]}.")
+    if duplicates:
+        print(
+            f"Skipped {len(duplicates)} images already in data under another "
+            f"name, e.g. {duplicates[0]}, use Relink moved images if they were moved."
         )
-    return image_paths
+    return added
+
+
+def walk_images(path: str, prune: set[str] = PRUNE_DIRS):
+    """Yield paths relative to path of images in path *and its subfolders*.
+
+    One os.scandir() pass over the tree, extensions matched case insensitively
+    against IMAGE_EXTENSIONS, folders named in prune are skipped.
+    """
+    folders = [""]
+    while folders:
+        folder = folders.pop()
+        with os.scandir(os.path.join(path, folder)) as entries:
+            entries = sorted(entries, key=lambda x: x.name)
+        subfolders = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in prune:
+                    subfolders.append(os.path.join(folder, entry.name))
+            elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(folder, entry.name)
+        folders.extend(reversed(subfolders))
+
+
+def image_list(path: str) -> list[str]:
+    """List of images from path *and its subfolders*."""
+    return list(walk_images(path))
 
 
 def read_exif(path: str) -> dict:
-    img = exif.Image(Path(path).open("rb"))
+    """EXIF_TAGS found in the header of the image at path."""
+    with Path(path).open("rb") as img:
+        return parse_exif_header(img.read(EXIF_HEAD))
+
+
+def read_metadata(path: str, chunk_size: int = HASH_CHUNK) -> dict:
+    """EXIF_TAGS, image_bytes and image_hash from one sequential read of path.
+
+    The file is hashed through a fixed size buffer, the EXIF tags are parsed
+    from the first chunk.
+    """
+    hasher = sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with Path(path).open("rb") as img:
+        size = os.fstat(img.fileno()).st_size
+        n = img.readinto(buffer)
+        head = bytes(view[:n])
+        while n:
+            hasher.update(view[:n])
+            n = img.readinto(buffer)
+    meta = parse_exif_header(head)
+    meta.update(image_bytes=size, image_hash=hasher.hexdigest())
+    return meta
+
+
+def _jpeg_segments(head: bytes):
+    """Yield (marker, data) for the JPEG segments in head before the image data."""
+    if head[:2] != b"\xff\xd8":
+        return
+    pos = 2
+    while pos + 4 <= len(head) and head[pos] == 0xFF:
+        marker = head[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):  # end of image, start of scan
+            break
+        length = int.from_bytes(head[pos + 2 : pos + 4], "big")
+        yield marker, head[pos + 4 : pos + 2 + length]
+        pos += 2 + length
+
+
+def parse_exif_header(head: bytes) -> dict:
+    """EXIF_TAGS from the APP1 segment, and size from SOFn, of JPEG bytes.
+
+    head only needs to contain the segments before the image data.  Non JPEG
+    or truncated data just gives fewer / no tags.
+    """
     result = {}
-    for key in img.list_all():
-        try:
-            result[key] = getattr(img, key)
-        except Exception:  # a zoo of different exceptions possible
+    for marker, segment in _jpeg_segments(head):
+        if marker == 0xE1 and segment[:6] == b"Exif\0\0":
+            result.update(_tiff_tags(segment[6:]))
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if len(segment) >= 5:  # start of frame, precision, height, width
+                result.setdefault(
+                    "pixel_y_dimension", int.from_bytes(segment[1:3], "big")
+                )
+                result.setdefault(
+                    "pixel_x_dimension", int.from_bytes(segment[3:5], "big")
+                )
+    return result
+
+
+def exif_thumbnail(head: bytes) -> bytes:
+    """The JPEG thumbnail embedded in the EXIF data of JPEG bytes, or None."""
+    for marker, segment in _jpeg_segments(head):
+        if marker == 0xE1 and segment[:6] == b"Exif\0\0":
+            return _tiff_thumbnail(segment[6:])
+    return None
+
+
+def _tiff_reader(tiff: bytes) -> tuple:
+    """(uint, entries) functions reading a TIFF structure, or None if not TIFF."""
+    order = {b"II": "little", b"MM": "big"}.get(tiff[:2])
+    if order is None:
+        return None
+
+    def uint(offset, size):
+        return int.from_bytes(tiff[offset : offset + size], order)
+
+    def entries(offset):
+        """(tag, type, count, value offset) for the IFD at offset"""
+        if offset + 2 > len(tiff):
+            return
+        for i in range(uint(offset, 2)):
+            entry = offset + 2 + 12 * i
+            if entry + 12 > len(tiff):
+                return
+            yield uint(entry, 2), uint(entry + 2, 2), uint(entry + 4, 4), entry + 8
+
+    return uint, entries
+
+
+def _tiff_tags(tiff: bytes) -> dict:
+    """EXIF_TAGS from the EXIF sub-IFD of a TIFF structure."""
+    reader = _tiff_reader(tiff)
+    if reader is None:
+        return {}
+    uint, entries = reader
+    ifd0 = {tag: at for tag, _, _, at in entries(uint(4, 4))}
+    if 0x8769 not in ifd0:  # no EXIF sub-IFD pointer
+        return {}
+    exif_ifd = uint(ifd0[0x8769], 4)
+    result = {}
+    for tag, type_, count, at in entries(exif_ifd):
+        name = EXIF_TAGS.get(tag)
+        if name is None:
             continue
-    # import pprint
-    # pprint.pprint(result)
+        if type_ == 2:  # ASCII, stored in place if it fits in 4 bytes
+            start = uint(at, 4) if count > 4 else at
+            text = tiff[start : start + count].split(b"\0")[0]
+            result[name] = text.decode("ascii", "replace").strip()
+        elif type_ == 3:  # SHORT
+            result[name] = uint(at, 2)
+        elif type_ == 4:  # LONG
+            result[name] = uint(at, 4)
     return result
 
 
+def _tiff_thumbnail(tiff: bytes) -> bytes:
+    """JPEG thumbnail from IFD1 of a TIFF structure, or None."""
+    reader = _tiff_reader(tiff)
+    if reader is None:
+        return None
+    uint, entries = reader
+    ifd0 = uint(4, 4)
+    if ifd0 + 2 > len(tiff):
+        return None
+    ifd1 = uint(ifd0 + 2 + 12 * uint(ifd0, 2), 4)  # next IFD after IFD0
+    if not ifd1:
+        return None
+    tags = {tag: uint(at, 4) for tag, _, _, at in entries(ifd1)}
+    start, length = tags.get(0x0201), tags.get(0x0202)  # JPEGInterchangeFormat
+    if not start or not length or start + length > len(tiff):
+        return None
+    thumb = tiff[start : start + length]
+    return thumb if thumb[:2] == b"\xff\xd8" else None
+
+
 def image_time_filename(exif: dict) -> str:
     """FIXME: assumes .jpg"""
     return exif["datetime_original"].replace(":", "").replace(" ", "_") + ".jpg"
 
 
 def new_image_names(
-    basedir: str, paths: list[str], do_renames: bool = False
+    basedir: str,
+    paths: list[str],
+    do_renames: bool = False,
+    cache=None,
+    progress=None,
 ) -> list[(str, str)]:
     renames = []
-    for img_path in paths:
-        exif = read_exif(Path(basedir) / img_path)
-        name = image_time_filename(exif)
-        if Path(img_path).name != name:
-            new_path = Path(img_path).with_name(name)
-            renames.append((img_path, new_path))
-            if do_renames:
-                (Path(basedir) / img_path).rename(Path(basedir) / new_path)
+    with metadata_cache(basedir, cache) as cache:
+        for done, (img_path, exif) in enumerate(
+            image_metadata(basedir, paths, cache=cache), 1
+        ):
+            if progress:
+                progress(done, len(paths))
+            name = image_time_filename(exif)
+            if Path(img_path).name != name:
+                new_path = Path(img_path).with_name(name)
+                renames.append((img_path, new_path))
+                if do_renames:
+                    (Path(basedir) / img_path).rename(Path(basedir) / new_path)
+                    if cache is not None:
+                        cache.rename(img_path, str(new_path))
     return renames
 
 
-def check_new(con: object, img_path: str):
-    img_paths = set(image_list(img_path))
-    img_recs = set(map(lambda x: x[0], con.execute("select image_path from imgdata")))
+def clear_cache(basedir: str) -> None:
+    """Forget cached image metadata for basedir, e.g. after editing images."""
+    with metadata_cache(basedir) as cache:
+        if cache is not None:
+            cache.invalidate()
+            print(f"Cleared image metadata cache for {basedir}")
+
+
+def scan_folder(
+    path: str, cache=None, prune: set[str] = PRUNE_DIRS, progress=None
+) -> dict:
+    """{relative path: size} for images in path *and its subfolders*.
+
+    Adding, removing, or renaming a folder's entries changes its mtime, so a
+    folder whose mtime matches its listing in cache (a MetadataCache) is not
+    listed again, only stat()ed.  Changed listings are stored for next time.
+    """
+    images = {}
+    folders = [""]
+    seen = []
+    changed = 0
+    while folders:
+        folder = folders.pop()
+        fullpath = os.path.join(path, folder)
+        mtime_ns = os.stat(fullpath).st_mtime_ns
+        listing = cache.listing(folder) if cache is not None else None
+        if listing is not None and listing[0] == mtime_ns:
+            entries = listing[1]
+        else:
+            changed += 1
+            entries = []
+            with os.scandir(fullpath) as items:
+                for item in items:
+                    if item.is_dir(follow_symlinks=False):
+                        if item.name not in prune:
+                            entries.append((item.name, True, None))
+                    elif os.path.splitext(item.name)[1].lower() in IMAGE_EXTENSIONS:
+                        entries.append((item.name, False, item.stat().st_size))
+            if cache is not None:
+                if time.time_ns() - mtime_ns < RACY_NS:
+                    mtime_ns = None  # might change again within mtime resolution
+                cache.set_listing(folder, mtime_ns, entries)
+        seen.append(folder)
+        if progress:
+            progress(len(seen), None)
+        for name, is_dir, size in sorted(entries, reverse=True):
+            if is_dir:
+                folders.append(os.path.join(folder, name))
+            else:
+                images[os.path.join(folder, name)] = size
+    if cache is not None:
+        cache.retain_folders(seen)
+    print(f"Listed {changed} changed of {len(seen)} folders.")
+    return images
+
+
+def folder_changes(con: object, img_path: str, cache=None, progress=None) -> FolderDiff:
+    """Images in img_path but not in the data, and vice versa.
+
+    Records whose image is gone are paired with new images with the same
+    name and size, where that's unique, and reported as moved (old, new) if
+    the new image has the record's image_hash.
+    """
+    recs = {}
+    hashes = {}
+    for path, name, size, image_hash in con.execute(
+        "select image_path, image_name, image_bytes, image_hash from imgdata"
+    ):
+        recs[path] = (name, size)
+        hashes[path] = image_hash
+    with metadata_cache(img_path, cache) as cache:
+        images = scan_folder(img_path, cache, progress=progress)
+        added = defaultdict(list)
+        for path, size in images.items():
+            if path not in recs:
+                added[(os.path.basename(path), size)].append(path)
+        removed = defaultdict(list)
+        for path, key in recs.items():
+            if path not in images:
+                removed[key].append(path)
+        pairs = [
+            (removed[key][0], paths[0])
+            for key, paths in added.items()
+            if len(paths) == 1 and len(removed.get(key, ())) == 1
+        ]
+        new_meta = image_metadata(img_path, [new for _, new in pairs], cache=cache)
+        moved = [
+            (old, new)
+            for (old, new), (_, meta) in zip(pairs, new_meta)
+            if hashes[old] is not None and meta["image_hash"] == hashes[old]
+        ]
+    moved_from = set(i[0] for i in moved)
+    moved_to = set(i[1] for i in moved)
+    return FolderDiff(
+        added=[i for paths in added.values() for i in paths if i not in moved_to],
+        removed=[i for paths in removed.values() for i in paths if i not in moved_from],
+        moved=moved,
+        images=len(images),  # image paths in folder
+        records=len(recs),  # image paths in data
+    )
+
+
+def move_images(con: object, moves: list[(str, str)]) -> None:
+    """Point records at the new path for each (old, new) image path."""
+    with transaction(con):
+        con.executemany(
+            "update imgdata set image_path = ?, image_name = ? where image_path = ?",
+            [(new, Path(new).name, old) for old, new in moves],
+        )
+
+
+def relink_images(
+    con: object, img_path: str, cache=None, workers: int = None, progress=None
+) -> list[tuple]:
+    """Re-link records whose image is missing to the image with the same hash.
+
+    Images in img_path are hashed in parallel (through the image cache) and
+    joined to imgdata on image_hash, image_path / image_name are updated in
+    one statement.  Returns [(image_hash, paths), ...] for images found at
+    more than one path, which are reported and not re-linked.
+    """
+    with metadata_cache(img_path, cache) as cache:
+        images = scan_folder(img_path, cache)
+        folder = []
+        for path, meta in image_metadata(img_path, images, workers, cache=cache):
+            folder.append((path, Path(path).name, meta["image_hash"]))
+            if progress:
+                progress(len(folder), len(images))
+    with transaction(con):
+        con.execute(
+            "create temp table if not exists folder (path text, name, hash text)"
+        )
+        con.execute("delete from folder")
+        con.executemany("insert into folder values (?, ?, ?)", folder)
+        con.execute("create index if not exists temp.folder_hash on folder (hash)")
+        con.execute("create index if not exists temp.folder_path on folder (path)")
+
+        duplicates = list(
+            con.execute(
+                "select hash, group_concat(path, ' | ') from folder "
+                "group by hash having count(*) > 1"
+            )
+        )
+        duplicates += list(
+            con.execute(
+                "select image_hash, group_concat(image_path, ' | ') from "
+                "(select distinct image_hash, image_path from imgdata "
+                "where image_hash is not null) "
+                "group by image_hash having count(*) > 1"
+            )
+        )
+        for hash_, paths in duplicates:
+            print(f"Duplicate image {hash_[:8]}…: {paths}")
+
+        res = con.execute(
+            "update imgdata set "
+            "image_path = (select path from folder where hash = imgdata.image_hash), "
+            "image_name = (select name from folder where hash = imgdata.image_hash) "
+            "where image_path not in (select path from folder) "
+            "and image_hash in "
+            "(select hash from folder group by hash having count(*) = 1) "
+            "and image_hash not in (select image_hash from imgdata "
+            "where image_path in (select path from folder) "
+            "and image_hash is not null)"
+        )
+    print(f"Re-linked {res.rowcount} records, {len(duplicates)} duplicate images.")
+    return duplicates
+
+
+def check_new(con: object, img_path: str, progress=None) -> FolderDiff:
+    diff = folder_changes(con, img_path, progress=progress)
     print("")
-    print(f"{len(img_paths)} images in folder.")
-    print(f"{len(img_recs)} records in data.")
-    print(f"{len(img_paths-img_recs)} in folder only.")
-    print(f"{len(img_recs-img_paths)} in data only.")
-    print(f"{len(img_recs&img_paths)} in both.")
+    print(f"{diff.images} images in folder.")
+    print(f"{diff.records} records in data.")
+    print(f"{len(diff.added)} in folder only.")
+    print(f"{len(diff.removed)} in data only.")
+    print(f"{len(diff.moved)} moved in folder.")
+    print(f"{diff.records - len(diff.removed) - len(diff.moved)} in both.")
+    return diff
 
 
-def load_new(con: object, img_path: str):
-    img_paths = set(image_list(img_path))
-    img_recs = set(map(lambda x: x[0], con.execute("select image_path from imgdata")))
-    new = img_paths - img_recs
-    print(f"Adding {len(img_paths-img_recs)} images.")
-    add_images(con, img_path, new)
+def load_new(con: object, img_path: str, progress=None) -> FolderDiff:
+    with metadata_cache(img_path) as cache:
+        diff = folder_changes(con, img_path, cache, progress)
+        if diff.moved:
+            print(f"Updating paths for {len(diff.moved)} moved images.")
+            move_images(con, diff.moved)
+        print(f"Adding {len(diff.added)} images.")
+        add_images(con, img_path, diff.added, cache=cache, progress=progress)
+    return diff
 
 
 def unset_related(con: object, obs_id: str) -> None:
-    cur = con.cursor()
-    cur.execute(
-        "update imgdata set group_id=? where observation_id=?", [uuid4().hex, obs_id]
-    )
+    with transaction(con):
+        con.execute(
+            "update imgdata set group_id=? where observation_id=?",
+            [uuid4().hex, obs_id],
+        )
 
 
 def set_related(con: object, obs_id0: str, obs_id1: str) -> None:
     """Move obs_id0 into the same group as obs_id1"""
-    cur = con.cursor()
-    cur.execute(
-        "select * from imgdata where observation_id in (?, ?)",
-        [obs_id0, obs_id1],
-    )
-    obs = named_tuples(cur)
-    # *** need to maintain ordering ***
-    if obs[0].observation_id != obs_id0:
-        obs.reverse()
-
-    cur.execute(
-        "update imgdata set group_id=? where observation_id=?",
-        [
-            obs[1].group_id,
-            obs[0].observation_id,
-        ],
+    with transaction(con):
+        cur = con.cursor()
+        cur.execute(
+            "select * from imgdata where observation_id in (?, ?)",
+            [obs_id0, obs_id1],
+        )
+        obs = named_tuples(cur)
+        # *** need to maintain ordering ***
+        if obs[0].observation_id != obs_id0:
+            obs.reverse()
+
+        cur.execute(
+            "update imgdata set group_id=? where observation_id=?",
+            [
+                obs[1].group_id,
+                obs[0].observation_id,
+            ],
+        )
+        copy = schema().copy
+        for from_, to in (0, 1), (1, 0):
+            updates = {
+                field_name: getattr(obs[from_], field_name, None)
+                for field_name in copy
+                if getattr(obs[to], field_name, None) is None
+            }
+            if updates:
+                values = list(updates.values()) + [obs[to].observation_id]
+                con.execute(update_sql(tuple(updates)), values)
+
+
+def suggest_groups(con, gap: int = GROUP_GAP) -> list[GroupSuggestion]:
+    """Runs of images less than gap seconds apart, per camera_deploy.
+
+    Only first groups in an image (group_number 1) not marked as having no
+    relevant content are considered.  Runs of one image, or already all in
+    one group, aren't suggested.  ids are observation_ids in time order.
+    """
+    rows = con.execute(
+        "with gaps as (select rowid, observation_id, group_id, camera_deploy, "
+        "image_epoch, image_epoch - lag(image_epoch) over ("
+        "partition by camera_deploy order by image_epoch, rowid) as gap "
+        "from imgdata where group_number = 1 and image_epoch is not null "
+        "and coalesce(observation_status, '') not in (%s)), "
+        "runs as (select *, sum(gap is null or gap >= ?) over ("
+        "partition by camera_deploy order by image_epoch, rowid) as run from gaps) "
+        "select camera_deploy, run, image_epoch, observation_id, group_id "
+        "from runs order by camera_deploy, run, image_epoch, rowid"
+        % ",".join("?" * len(NO_CONTENT)),
+        NO_CONTENT + [gap],
     )
-    for from_, to in (0, 1), (1, 0):
-        updates = {}
-        for field_name, field in field_defs()["fields"].items():
-            if field.get("copy") and getattr(obs[to], field_name, None) is None:
-                updates[field_name] = getattr(obs[from_], field_name, None)
-        if updates:
-            q = ["update imgdata set"]
-            fields = ", ".join(f"{i}=?" for i in updates)
-            q.append(fields)
-            q.append("where observation_id=?")
-            q = " ".join(q)
-            values = list(updates.values()) + [obs[to].observation_id]
-            print(values)
-            con.execute(q, values)
+    suggestions = []
+    for (camera_deploy, _), run in groupby(rows, key=lambda row: row[:2]):
+        run = list(run)
+        if len(set(row[4] for row in run)) > 1:
+            ids = [row[3] for row in run]
+            suggestions.append(
+                GroupSuggestion(camera_deploy, run[0][2], run[-1][2], ids)
+            )
+    return suggestions
+
+
+def apply_groups(con, groups: list[list[str]]) -> int:
+    """Put each list of observation_ids in one group, return records moved.
+
+    Each list joins the group of its first observation.  Empty copy fields
+    (see Schema) in the affected groups are filled from the group's earliest
+    record with a value, as set_related() does for pairs.
+    """
+    with transaction(con):
+        con.execute(
+            "create temp table if not exists suggested "
+            "(observation_id text primary key, group_id text)"
+        )
+        con.execute("delete from suggested")
+        con.executemany(
+            "insert or replace into suggested "
+            "select ?, group_id from imgdata where observation_id = ?",
+            [(obs_id, ids[0]) for ids in groups for obs_id in ids],
+        )
+        res = con.execute(
+            "update imgdata set group_id = (select group_id from suggested "
+            "where suggested.observation_id = imgdata.observation_id) "
+            "where observation_id in (select observation_id from suggested) "
+            "and group_id is not (select group_id from suggested "
+            "where suggested.observation_id = imgdata.observation_id)"
+        )
+        moved = res.rowcount
+        columns = [i[1] for i in con.execute("pragma table_info(imgdata)")]
+        copy = [i for i in schema().copy if i in columns]
+        if copy:
+            con.execute(
+                "update imgdata set "
+                + ", ".join(
+                    f"{name} = coalesce({name}, (select g.{name} from imgdata g "
+                    f"where g.group_id = imgdata.group_id and g.{name} is not null "
+                    "order by g.image_epoch, g.group_number limit 1))"
+                    for name in copy
+                )
+                + " where group_id in (select group_id from suggested)"
+            )
+    print(f"Grouped {moved} records into {len(groups)} groups.")
+    return moved
 
 
 if __name__ == "__main__":
     # print(image_list("pics"))
     # create_data_file("test.xlsx")
     con = xlsx_to_sqlite("test.xlsx", ":memory:")
-    add_images(con, image_list("pics"))
+    add_images(con, "pics", image_list("pics"))
     sqlite_to_xlsx(con, "test.xlsx")
     # print(new_image_names(image_list("pics")))
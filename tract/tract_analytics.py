@@ -0,0 +1,239 @@
+"""Activity durations and usage counts from classified observations.
+
+Each group_id is one visit, an observation without a group_id is a visit on
+its own.  Per visit start, end, duration, party size (the most adults_n,
+children_n, pets_n in any of its images), and the most common activity and
+direction are kept in the group_summary table in the working database.
+Triggers on imgdata queue changed groups in summary_dirty, so refresh() only
+recomputes those.  Images with NO_CONTENT statuses are left out.  Usage:
+
+    python tract_analytics.py data.xlsx summary.xlsx
+
+The summary can also be .csv, the counts table is then written beside it.
+"""
+
+import sys
+
+import tract
+
+SUMMARY_COLUMNS = [  # group_summary, after group_key
+    "group_id",
+    "camera_deploy",
+    "start_epoch",
+    "end_epoch",
+    "duration_s",
+    "images",
+    "adults_n",
+    "children_n",
+    "pets_n",
+    "activity",
+    "direction",
+]
+TRACKED = {  # imgdata columns group_summary depends on
+    "group_id",
+    "observation_id",
+    "image_epoch",
+    "observation_status",
+    "camera_deploy",
+    "adults_n",
+    "children_n",
+    "pets_n",
+    "activity",
+    "direction",
+}
+GROUP_FIELDS = [
+    "group_id",
+    "camera_deploy",
+    "start",
+    "end",
+    "duration_s",
+    "images",
+    "adults_n",
+    "children_n",
+    "pets_n",
+    "activity",
+    "direction",
+]
+COUNT_FIELDS = ["count_by", "value", "groups", "adults_n", "children_n", "pets_n"]
+COUNT_BY = {  # count_by: expression on group_summary
+    "activity": "activity",
+    "direction": "direction",
+    "hour": "cast(strftime('%H', start_epoch, 'unixepoch') as integer)",
+    "weekday": "cast(strftime('%w', start_epoch, 'unixepoch') as integer)",
+    "camera_deploy": "camera_deploy",
+}
+WEEKDAYS = "Sunday Monday Tuesday Wednesday Thursday Friday Saturday".split()
+TIME_FORMAT = "%Y/%m/%d %H:%M:%S"  # as image_time
+
+
+def number(column: str) -> str:
+    """SQL for column as an integer, NULL for "N/A" or empty."""
+    return f"case when trim({column}) glob '[0-9]*' then cast({column} as integer) end"
+
+
+OBS_SQL = f"""
+create temp table summary_obs as
+select
+    group_key,
+    group_id,
+    camera_deploy,
+    image_epoch,
+    {number("adults_n")} as adults_n,
+    {number("children_n")} as children_n,
+    {number("pets_n")} as pets_n,
+    activity,
+    direction
+from (
+    select group_id as group_key, * from imgdata
+    where group_id in (select group_key from summary_dirty)
+    union all
+    select observation_id, * from imgdata
+    where observation_id in (select group_key from summary_dirty)
+    and +group_id is null
+)
+where coalesce(observation_status, '') not in (%s)
+""" % ",".join("?" * len(tract.NO_CONTENT))  # images in queued groups
+REFRESH_SQL = """
+insert into group_summary (group_key, %s)
+select
+    group_key,
+    max(group_id),
+    min(camera_deploy),
+    min(image_epoch),
+    max(image_epoch),
+    max(image_epoch) - min(image_epoch),
+    count(*),
+    max(adults_n),
+    max(children_n),
+    max(pets_n)
+from summary_obs
+group by group_key
+""" % ", ".join(SUMMARY_COLUMNS[:-2])
+
+
+def mode_sql(column: str) -> str:
+    """SQL setting group_summary.column to its most frequent value in the group."""
+    return f"""
+    update group_summary set {column} = ranked.{column}
+    from (
+        select group_key, {column}, row_number() over (
+            partition by group_key order by count(*) desc, min(image_epoch)
+        ) as rank
+        from summary_obs where {column} is not null and {column} != ''
+        group by group_key, {column}
+    ) as ranked
+    where ranked.group_key = group_summary.group_key and ranked.rank = 1
+    """
+
+
+def create_summary(con) -> None:
+    """Create group_summary, summary_dirty, and their triggers if missing.
+
+    A new group_summary has every group queued for refresh().  Reimporting
+    the data file recreates imgdata, dropping the triggers, so the summary is
+    then rebuilt.
+    """
+    names = {
+        i[0]
+        for i in con.execute(
+            "select name from sqlite_master "
+            "where name in ('group_summary', 'summary_dirty_insert')"
+        )
+    }
+    if len(names) == 2:
+        return
+    columns = [i[1] for i in con.execute("pragma table_info(imgdata)")]
+    tracked = ", ".join(i for i in columns if i in TRACKED)
+    key = "coalesce({0}.group_id, {0}.observation_id)"
+    queue = "insert or ignore into summary_dirty values (%s);"
+    with tract.transaction(con):
+        con.execute("drop table if exists group_summary")
+        con.execute("drop table if exists summary_dirty")
+        con.execute("create table summary_dirty (group_key text primary key)")
+        con.execute(
+            "create table group_summary (group_key text primary key, %s)"
+            % ", ".join(SUMMARY_COLUMNS)
+        )
+        for event, when, rows in [
+            ("insert", "insert", ["new"]),
+            ("update", f"update of {tracked}", ["old", "new"]),
+            ("delete", "delete", ["old"]),
+        ]:
+            con.execute(
+                f"create trigger summary_dirty_{event} after {when} on imgdata "
+                "begin %s end" % " ".join(queue % key.format(i) for i in rows)
+            )
+        con.execute(
+            "insert or ignore into summary_dirty "
+            "select coalesce(group_id, observation_id) from imgdata"
+        )
+
+
+def refresh(con) -> int:
+    """Recompute group_summary for changed groups, return the number changed."""
+    create_summary(con)
+    with tract.transaction(con):
+        dirty = con.execute("select count(*) from summary_dirty").fetchone()[0]
+        if dirty:
+            con.execute(
+                "delete from group_summary "
+                "where group_key in (select group_key from summary_dirty)"
+            )
+            con.execute(OBS_SQL, tract.NO_CONTENT)
+            con.execute(REFRESH_SQL)
+            for column in "activity", "direction":
+                con.execute(mode_sql(column))
+            con.execute("drop table summary_obs")
+            con.execute("delete from summary_dirty")
+    return dirty
+
+
+def groups(con) -> list[tuple]:
+    """GROUP_FIELDS rows of group_summary, in time order."""
+    return con.execute(f"""
+        select group_key, camera_deploy,
+            strftime('{TIME_FORMAT}', start_epoch, 'unixepoch'),
+            strftime('{TIME_FORMAT}', end_epoch, 'unixepoch'),
+            duration_s, images, adults_n, children_n, pets_n, activity, direction
+        from group_summary order by start_epoch, group_key
+        """).fetchall()
+
+
+def counts(con) -> list[list]:
+    """COUNT_FIELDS rows, groups and party totals for each COUNT_BY value."""
+    rows = []
+    for count_by, expr in COUNT_BY.items():
+        for value, *totals in con.execute(
+            f"select {expr}, count(*), sum(adults_n), sum(children_n), sum(pets_n) "
+            "from group_summary group by 1 order by 1"
+        ):
+            if count_by == "weekday" and value is not None:
+                value = WEEKDAYS[value]
+            rows.append([count_by, value, *totals])
+    return rows
+
+
+def write_summary(summary_path: str, con) -> None:
+    """Write .xlsx with Groups and Counts sheets, or .csv plus <name>-counts.csv."""
+    tables = [
+        ("Groups", GROUP_FIELDS, groups(con)),
+        ("Counts", COUNT_FIELDS, counts(con)),
+    ]
+    tract.write_tables(summary_path, tables, "counts")
+
+
+def summarize(con, summary_path: str) -> int:
+    """refresh() and write_summary(), return the number of groups."""
+    refresh(con)
+    write_summary(summary_path, con)
+    n = con.execute("select count(*) from group_summary").fetchone()[0]
+    print(f"Wrote {n} groups to {summary_path}")
+    return n
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    con = tract.data_to_sqlite(sys.argv[1], ":memory:")
+    summarize(con, sys.argv[2])
@@ -0,0 +1,162 @@
+"""Sidecar cache of image metadata, kept in the image folder.
+
+Reading an image's EXIF data and hash means reading the whole file, so results
+are kept in a small SQLite file keyed by (relative path, size, mtime_ns).  A
+rescan of unchanged images then only needs a stat() per file.
+
+The same file holds a snapshot of each folder's listing and mtime, so folders
+that haven't changed don't need to be listed again, see tract.scan_folder().
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+
+CACHE_DIR = ".tract"  # in the image folder, not searched for images
+CACHE_FILE = "metadata.db"
+CACHE_MAX_ROWS = 500_000  # oldest entries dropped beyond this
+CACHE_FIELDS = [  # read_metadata() keys stored
+    "datetime_original",
+    "pixel_x_dimension",
+    "pixel_y_dimension",
+    "image_bytes",
+    "image_hash",
+]
+
+
+class MetadataCache:
+    """tract.read_metadata() results and folder listings for basedir."""
+
+    def __init__(self, basedir: str, max_rows: int = CACHE_MAX_ROWS):
+        path = Path(basedir) / CACHE_DIR
+        path.mkdir(exist_ok=True)
+        self.max_rows = max_rows
+        self.hits = self.misses = 0
+        self.con = sqlite3.connect(path / CACHE_FILE)
+        # WAL doesn't work on network filesystems, also undoes older caches' WAL
+        self.con.execute("pragma journal_mode=delete")
+        self.con.execute("pragma synchronous=normal")
+        self.con.execute(
+            "create table if not exists metadata ("
+            "path text primary key, size integer, mtime_ns integer, "
+            + ", ".join(CACHE_FIELDS)
+            + ")"
+        )
+        self.con.execute(
+            "create table if not exists folders (path text primary key, mtime_ns)"
+        )
+        self.con.execute(
+            "create table if not exists folder_entries "
+            "(folder text, name text, is_dir integer, size integer)"
+        )
+        self.con.execute(
+            "create index if not exists folder_entries_folder "
+            "on folder_entries (folder)"
+        )
+
+    def get(self, path: str, stat) -> dict:
+        """Cached metadata for path if size and mtime match stat, else None."""
+        row = self.con.execute(
+            "select %s from metadata where path = ? and size = ? and mtime_ns = ?"
+            % ",".join(CACHE_FIELDS),
+            [path, stat.st_size, stat.st_mtime_ns],
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {k: v for k, v in zip(CACHE_FIELDS, row) if v is not None}
+
+    def put(self, path: str, stat, meta: dict) -> None:
+        self.con.execute(
+            "insert or replace into metadata values (%s)"
+            % ",".join("?" * (len(CACHE_FIELDS) + 3)),
+            [path, stat.st_size, stat.st_mtime_ns]
+            + [meta.get(i) for i in CACHE_FIELDS],
+        )
+
+    def listing(self, folder: str) -> tuple:
+        """(mtime_ns, [(name, is_dir, size), ...]) stored for folder, or None."""
+        row = self.con.execute(
+            "select mtime_ns from folders where path = ?", [folder]
+        ).fetchone()
+        if row is None:
+            return None
+        entries = self.con.execute(
+            "select name, is_dir, size from folder_entries where folder = ?",
+            [folder],
+        ).fetchall()
+        return row[0], entries
+
+    def set_listing(self, folder: str, mtime_ns: int, entries: list[tuple]) -> None:
+        self.con.execute(
+            "insert or replace into folders values (?, ?)", [folder, mtime_ns]
+        )
+        self.con.execute("delete from folder_entries where folder = ?", [folder])
+        self.con.executemany(
+            "insert into folder_entries values (?, ?, ?, ?)",
+            [[folder] + list(i) for i in entries],
+        )
+
+    def retain_folders(self, folders: list[str]) -> None:
+        """Forget listings for folders not in folders, i.e. removed ones."""
+        self.con.execute("create temp table if not exists seen (path text)")
+        self.con.execute("delete from seen")
+        self.con.executemany("insert into seen values (?)", [[i] for i in folders])
+        self.con.execute("delete from folders where path not in (select * from seen)")
+        self.con.execute(
+            "delete from folder_entries where folder not in (select * from seen)"
+        )
+
+    def rename(self, old: str, new: str) -> None:
+        """Follow a file rename, which doesn't change size or mtime."""
+        self.con.execute("delete from metadata where path = ?", [new])
+        self.con.execute("update metadata set path = ? where path = ?", [new, old])
+
+    def invalidate(self, paths: list[str] = None) -> None:
+        """Forget paths, or everything including folder listings if None."""
+        if paths is None:
+            self.con.execute("delete from metadata")
+            self.con.execute("delete from folders")
+            self.con.execute("delete from folder_entries")
+        else:
+            self.con.executemany(
+                "delete from metadata where path = ?", [[i] for i in paths]
+            )
+        self.con.commit()
+
+    def prune(self) -> None:
+        """Drop the least recently stored entries beyond max_rows."""
+        self.con.execute(
+            "delete from metadata where rowid in "
+            "(select rowid from metadata order by rowid desc limit -1 offset ?)",
+            [self.max_rows],
+        )
+
+    def close(self) -> None:
+        self.prune()
+        self.con.commit()
+        self.con.close()
+        if self.hits or self.misses:
+            print(f"Image cache: {self.hits} hits, {self.misses} misses.")
+
+
+@contextmanager
+def metadata_cache(basedir: str, cache: MetadataCache = None):
+    """Yield cache if given, else a MetadataCache for basedir closed on exit.
+
+    Yields None if the cache can't be opened, e.g. read-only image folder.
+    """
+    if cache is not None:
+        yield cache
+        return
+    try:
+        cache = MetadataCache(basedir)
+    except (OSError, sqlite3.Error) as exc:
+        print(f"Not using image cache: {exc}")
+        yield None
+        return
+    try:
+        yield cache
+    finally:
+        cache.close()
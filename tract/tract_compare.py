@@ -0,0 +1,136 @@
+"""Compare two coders' data files for the same images.
+
+Replaces the manual Excel comparison procedure in the README.  Records are
+matched on (image_hash, group_number), or (image_name, group_number) where
+the hash doesn't match, so extra groups or missing days don't shift the
+comparison.  Usage:
+
+    python tract_compare.py coder_a.xlsx coder_b.xlsx report.xlsx
+
+The report can also be .csv, the agreement table is then written beside it.
+"""
+
+import sys
+
+import tract
+
+IGNORE = {  # not expected to match, see README
+    "group_id",
+    "observation_id",
+    "image_path_full",
+    "entry_by",
+    "qa_by",
+} | set(
+    tract.SHADOW_COLUMNS
+)  # working database only
+KEY_FIELDS = ["image_time", "image_name", "group_number"]  # identify rows in report
+REPORT_FIELDS = KEY_FIELDS + ["field", "value_a", "value_b"]
+AGREEMENT_FIELDS = ["field", "compared", "agree", "disagree", "agree_pct"]
+
+
+def records(con) -> tuple[list[str], list[tuple]]:
+    """(column names, rows) of imgdata."""
+    cur = con.execute("select * from imgdata")
+    return [i[0] for i in cur.description], cur.fetchall()
+
+
+def same(a, b) -> bool:
+    """Values equal, treating None as "" and 2 as "2"."""
+    a = "" if a is None else str(a).strip()
+    b = "" if b is None else str(b).strip()
+    return a == b
+
+
+def compare(con_a, con_b, ignore: set[str] = IGNORE) -> tuple[list, list]:
+    """(discrepancies, agreement) rows comparing imgdata in con_a and con_b.
+
+    discrepancies are REPORT_FIELDS rows, one per differing field, plus one
+    per record only found in one of the data sets.  agreement is
+    AGREEMENT_FIELDS rows for each field compared.
+    """
+    fields_a, rows_a = records(con_a)
+    fields_b, rows_b = records(con_b)
+    col_a = {k: i for i, k in enumerate(fields_a)}
+    col_b = {k: i for i, k in enumerate(fields_b)}
+    fields = [i for i in fields_a if i in col_b and i not in ignore]
+
+    def key(row, col, name):
+        return row[col[name]] if name in col else None, row[col["group_number"]]
+
+    by_hash = {}
+    by_name = {}
+    for row in rows_a:
+        by_hash.setdefault(key(row, col_a, "image_hash"), row)
+        by_name.setdefault(key(row, col_a, "image_name"), row)
+
+    def describe(row, col):
+        return [row[col[i]] if i in col else None for i in KEY_FIELDS]
+
+    discrepancies = []
+    agree = dict.fromkeys(fields, 0)
+    compared = 0
+    matched = set()
+    for row_b in rows_b:
+        row_a = None
+        hash_key = key(row_b, col_b, "image_hash")
+        if hash_key[0] is not None:
+            row_a = by_hash.get(hash_key)
+        if row_a is None or id(row_a) in matched:
+            row_a = by_name.get(key(row_b, col_b, "image_name"))
+        if row_a is None or id(row_a) in matched:
+            discrepancies.append(describe(row_b, col_b) + ["(record)", None, "only"])
+            continue
+        matched.add(id(row_a))
+        compared += 1
+        for field in fields:
+            value_a, value_b = row_a[col_a[field]], row_b[col_b[field]]
+            if same(value_a, value_b):
+                agree[field] += 1
+            else:
+                discrepancies.append(describe(row_a, col_a) + [field, value_a, value_b])
+    for row_a in rows_a:
+        if id(row_a) not in matched:
+            discrepancies.append(describe(row_a, col_a) + ["(record)", "only", None])
+    discrepancies.sort(key=lambda x: [str(i) for i in x[:4]])
+
+    agreement = [
+        [
+            field,
+            compared,
+            agree[field],
+            compared - agree[field],
+            round(100 * agree[field] / compared, 1) if compared else None,
+        ]
+        for field in fields
+    ]
+    print(
+        f"{compared} records compared, {len(rows_a) - compared} only in A, "
+        f"{len(rows_b) - compared} only in B, {len(discrepancies)} discrepancies."
+    )
+    return discrepancies, agreement
+
+
+def write_report(report_path: str, discrepancies: list, agreement: list) -> None:
+    """Write .xlsx with two sheets, or .csv plus <name>-agreement.csv."""
+    tables = [
+        ("Discrepancies", REPORT_FIELDS, discrepancies),
+        ("Agreement", AGREEMENT_FIELDS, agreement),
+    ]
+    tract.write_tables(report_path, tables, "agreement")
+
+
+def compare_files(path_a: str, path_b: str, report_path: str) -> list:
+    """Compare two data files, write the report, return the agreement rows."""
+    con_a = tract.data_to_sqlite(path_a, ":memory:")
+    con_b = tract.data_to_sqlite(path_b, ":memory:")
+    discrepancies, agreement = compare(con_a, con_b)
+    write_report(report_path, discrepancies, agreement)
+    print(f"Wrote {report_path}")
+    return agreement
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(1)
+    compare_files(*sys.argv[1:])
@@ -0,0 +1,113 @@
+"""Buffered console for the GUI, the target of print() and logging.
+
+Writing to the Text widget and repainting for every print() made bulk
+operations spend most of their time in Tk, so output is queued and written in
+batches at most FRAME_MS apart.  Writes can come from any thread, only the Tk
+thread touches the widget.
+"""
+
+import logging
+import queue
+import threading
+import time
+import tkinter as tk
+
+FRAME_MS = 100  # flush at most this often
+MAX_LINES = 5000  # scrollback kept
+TAG_COLOURS = {"debug": "gray50", "warning": "dark orange", "error": "red"}
+
+
+def level_tag(level: int) -> str:
+    """Text tag for a logging level, None (plain text) for INFO."""
+    if level >= logging.ERROR:
+        return "error"
+    if level >= logging.WARNING:
+        return "warning"
+    if level < logging.INFO:
+        return "debug"
+    return None
+
+
+class Console:
+    """Queue text for a Text widget, flushed from the Tk event loop."""
+
+    def __init__(self, text: tk.Text):
+        self.text = text
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.get_ident()  # the Tk thread
+        self.last_flush = 0
+        for tag, colour in TAG_COLOURS.items():
+            text.tag_configure(tag, foreground=colour)
+        text.after(FRAME_MS, self.poll)
+
+    def put(self, text: str, level: int = logging.INFO) -> None:
+        self.queue.put((text, level_tag(level)))
+        if threading.get_ident() == self.thread:
+            # long jobs on the Tk thread don't return to the event loop, so
+            # show progress here, no more than once a frame
+            if time.monotonic() - self.last_flush > FRAME_MS / 1000:
+                self.flush()
+                self.text.update_idletasks()
+
+    def poll(self) -> None:
+        self.flush()
+        self.text.after(FRAME_MS, self.poll)
+
+    def flush(self) -> None:
+        """Write queued text to the widget, Tk thread only."""
+        self.last_flush = time.monotonic()
+        if self.queue.empty():
+            return
+        chunks = []
+        while not self.queue.empty():
+            chunks.append(self.queue.get_nowait())
+        for text, tag in merge(chunks):
+            self.text.insert(tk.END, text, tag)
+        lines = int(self.text.index("end-1c").split(".")[0])
+        if lines > MAX_LINES:
+            self.text.delete("1.0", f"{lines - MAX_LINES}.0")
+        self.text.see(tk.END)
+
+
+def merge(chunks: list[tuple]) -> list[tuple]:
+    """Join consecutive (text, tag) chunks with the same tag."""
+    merged = []
+    for text, tag in chunks:
+        if merged and merged[-1][1] == tag:
+            merged[-1][0].append(text)
+        else:
+            merged.append(([text], tag))
+    return [("".join(texts), tag) for texts, tag in merged]
+
+
+class ConsoleStream:
+    """sys.stdout / sys.stderr replacement writing to a Console."""
+
+    def __init__(self, console: Console, level: int, mirror=None):
+        self.console = console
+        self.level = level
+        self.mirror = mirror  # also write here, e.g. the original stream
+
+    def write(self, text: str) -> int:
+        if self.mirror is not None:
+            self.mirror.write(text)
+        self.console.put(text, self.level)
+        return len(text)
+
+    def flush(self) -> None:
+        if self.mirror is not None:
+            self.mirror.flush()
+
+
+class ConsoleHandler(logging.Handler):
+    """logging handler writing records to a Console, tagged by level."""
+
+    def __init__(self, console: Console, level: int = logging.NOTSET):
+        super().__init__(level)
+        self.console = console
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.console.put(self.format(record) + "\n", record.levelno)
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,99 @@
+"""Decoded image cache and background prefetch for the image browser.
+
+Decoding a full size trail camera JPEG takes long enough to make stepping
+through images sluggish, so scaled images are kept in a bounded LRU cache and
+the images the user is likely to view next are decoded in a worker thread.
+Only PIL images are cached, Tk PhotoImages must be made on the Tk thread.
+"""
+
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+CACHE_BYTES = 256 * 1024 * 1024  # decoded image cache size
+PREFETCH = 3  # images to decode ahead in the direction of travel
+VIEW_SIZE = (1000, 1000)  # main browser image
+THUMB_SIZE = (200, 200)  # neighbouring thumbnails
+
+
+def load_scaled(path: str, size: tuple[int, int]) -> Image.Image:
+    """Decode the image at path scaled to fit size."""
+    with Image.open(path) as img:
+        img.thumbnail(size)  # uses JPEG draft mode to decode at reduced scale
+        return img.copy()  # usable after the file is closed
+
+
+def nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+class ImageCache:
+    """LRU cache of decoded, scaled PIL images, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.images = OrderedDict()  # (path, size): image
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.images
+
+    def get(self, path: str, size: tuple[int, int], load=None) -> Image.Image:
+        """The image at path scaled to fit size, from load() if not cached.
+
+        load defaults to decoding path with load_scaled().
+        """
+        key = (path, size)
+        with self.lock:
+            img = self.images.get(key)
+            if img is not None:
+                self.images.move_to_end(key)
+                return img
+        img = load() if load else load_scaled(path, size)
+        self.put(key, img)
+        return img
+
+    def put(self, key: tuple, img: Image.Image) -> None:
+        with self.lock:
+            if key in self.images:
+                return
+            self.images[key] = img
+            self.bytes += nbytes(img)
+            while self.bytes > self.max_bytes and len(self.images) > 1:
+                self.bytes -= nbytes(self.images.popitem(last=False)[1])
+
+    def clear(self) -> None:
+        with self.lock:
+            self.images.clear()
+            self.bytes = 0
+
+
+class Prefetcher:
+    """Decode requested images into an ImageCache in a background thread."""
+
+    def __init__(self, cache: ImageCache):
+        self.cache = cache
+        self.pending = []  # (path, size, load), most urgent first
+        self.ready = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def request(self, items: list[tuple]) -> None:
+        """Replace pending requests with items, ImageCache.get() arguments."""
+        with self.ready:
+            self.pending = [i for i in items if i[:2] not in self.cache]
+            self.ready.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.ready:
+                while not self.pending:
+                    self.ready.wait()
+                path, size, load = self.pending.pop(0)
+            if (path, size) in self.cache:
+                continue
+            try:
+                self.cache.get(path, size, load)
+            except Exception:  # missing / unreadable, reported when viewed
+                continue
@@ -0,0 +1,161 @@
+"""Background jobs for the GUI, so long operations don't freeze the window.
+
+Jobs run one at a time, in submission order, on a worker thread.  A job is a
+function taking a progress callback, see tract.Cancelled, which raises
+Cancelled once cancel() is called.  Progress and completion are passed back
+to the Tk thread through polling with after(), the job's done() callback runs
+there.  Working database writes are safe from the worker thread, see
+tract.StoreConnection.
+"""
+
+import queue
+import threading
+import time
+import tkinter.ttk as ttk
+import traceback
+
+import tract
+
+POLL_MS = 200  # progress display update interval
+
+
+class Job:
+    def __init__(self, name: str, run, done=None, always=None):
+        self.name = name
+        self.run = run  # run(progress), on the worker thread
+        self.done = done  # done(result), on the Tk thread, if run() succeeds
+        self.always = always  # always(), on the Tk thread, even if cancelled
+        self.result = None
+        self.error = None
+        self.state = (0, None)  # (done, total) from progress()
+        self.start = None
+
+
+class Jobs:
+    """Queue of Jobs, shown in a progress bar, label, and cancel button."""
+
+    def __init__(self, outer):
+        self.frame = ttk.Frame(outer)
+        self.label = ttk.Label(self.frame, text="", width=40)
+        self.bar = ttk.Progressbar(self.frame, length=200)
+        self.cancel_button = ttk.Button(
+            self.frame, text="Cancel", command=self.cancel, state="disabled"
+        )
+        for widget in self.label, self.bar, self.cancel_button:
+            widget.pack(side="left", padx=2)
+        self.todo = queue.Queue()
+        self.finished = queue.Queue()
+        self.queued = 0  # submitted, not finished
+        self.current = None
+        self.cancelled = threading.Event()
+        threading.Thread(target=self.work, daemon=True).start()
+        self.frame.after(POLL_MS, self.poll)
+
+    @property
+    def busy(self) -> bool:
+        return self.queued > 0
+
+    def submit(self, name: str, run, done=None, always=None) -> Job:
+        """Queue run(progress), then done(result) on the Tk thread.
+
+        always() runs on the Tk thread after run() however it ends, e.g. for
+        jobs that commit work in batches before they're cancelled or fail.
+        """
+        job = Job(name, run, done, always)
+        self.queued += 1
+        if self.current is not None:
+            print(f"{name} queued, will start after {self.current.name}")
+        self.todo.put(job)
+        self.show()
+        return job
+
+    def cancel(self) -> None:
+        """Cancel the running job, at its next progress() call."""
+        if self.current is not None:
+            self.cancelled.set()
+
+    def work(self) -> None:
+        while True:
+            job = self.todo.get()
+            self.cancelled.clear()
+            self.current = job
+            job.start = time.monotonic()
+
+            def progress(done, total=None, job=job):
+                job.state = (done, total)
+                if self.cancelled.is_set():
+                    raise tract.Cancelled(job.name)
+
+            try:
+                job.result = job.run(progress)
+            except tract.Cancelled:
+                job.error = "cancelled"
+                print(f"{job.name} cancelled.")
+            except Exception as exc:
+                job.error = exc
+                traceback.print_exc()
+                print(f"{job.name} failed: {exc}")
+            self.current = None
+            self.finished.put(job)
+
+    def poll(self) -> None:
+        self.frame.after(POLL_MS, self.poll)
+        while not self.finished.empty():
+            job = self.finished.get_nowait()
+            self.queued -= 1
+            if job.error is None and job.done is not None:
+                call(job.done, job.result)
+            if job.always is not None:
+                call(job.always)
+        self.show()
+
+    def show(self) -> None:
+        """Update the progress display for the current job."""
+        job = self.current
+        if job is None:
+            self.bar.stop()
+            self.bar.configure(mode="determinate", value=0)
+            self.label.configure(
+                text=f"{self.queued} jobs queued" if self.queued else ""
+            )
+            self.cancel_button.configure(state="disabled")
+            return
+        done, total = job.state
+        text = job.name
+        if total:
+            if str(self.bar["mode"]) == "indeterminate":
+                self.bar.stop()
+            self.bar.configure(mode="determinate", maximum=total, value=done)
+            elapsed = time.monotonic() - job.start
+            text += f" {done}/{total}"
+            if done:
+                text += f", {eta(elapsed / done * (total - done))} left"
+        else:
+            if str(self.bar["mode"]) != "indeterminate":
+                self.bar.configure(mode="indeterminate")
+                self.bar.start()
+            if done:
+                text += f" {done}"
+        if self.queued > 1:
+            text += f" (+{self.queued - 1} queued)"
+        self.label.configure(text=text)
+        self.cancel_button.configure(
+            state="disabled" if self.cancelled.is_set() else "normal"
+        )
+
+
+def call(callback, *args) -> None:
+    """callback(*args), printing rather than raising exceptions."""
+    try:
+        callback(*args)
+    except Exception:
+        traceback.print_exc()
+
+
+def eta(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
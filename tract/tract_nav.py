@@ -0,0 +1,134 @@
+"""Navigation index for stepping through observations in time order.
+
+Observations are ordered by (image_epoch, group_number, rowid).  The sorted
+keys, an observation_id -> key map, and a sorted key list per kind of
+observation_status are kept in memory, so next / previous, filtered or not,
+and big jumps are a bisect rather than a query or list scan.  Single rows are
+updated in place after edits or inserts, see refresh().
+"""
+
+from bisect import bisect_left, bisect_right, insort
+
+NULL_KEY = -(1 << 62)  # sorts NULL image_epoch / group_number first, as SQLite
+KEY_QUERY = (
+    "select rowid, image_epoch, group_number, observation_status, observation_id "
+    "from imgdata"
+)
+
+
+def sort_key(rowid: int, image_epoch: int, group_number) -> tuple:
+    if group_number is not None:
+        try:
+            group_number = int(group_number)
+        except ValueError:
+            group_number = None
+    return (
+        NULL_KEY if image_epoch is None else image_epoch,
+        NULL_KEY if group_number is None else group_number,
+        rowid,
+    )
+
+
+class NavIndex:
+    """Time ordered observation_ids in imgdata, filtered by kinds.
+
+    kinds maps a name to the observation_status values it includes, or None
+    for all observations, like tract_tk.OBS_TYPES.
+    """
+
+    def __init__(self, con, kinds: dict):
+        self.con = con
+        self.kinds = {k: set(v) for k, v in kinds.items() if v is not None}
+        self.load()
+
+    def load(self) -> None:
+        """(Re)build the index from imgdata."""
+        self.keys = []  # sorted
+        self.key = {}  # observation_id: key
+        self.obs_id = {}  # rowid: observation_id
+        self.status = {}  # observation_id: observation_status
+        for rowid, epoch, group_number, status, obs_id in self.con.execute(KEY_QUERY):
+            key = sort_key(rowid, epoch, group_number)
+            self.keys.append(key)
+            self.key[obs_id] = key
+            self.obs_id[rowid] = obs_id
+            self.status[obs_id] = status
+        self.keys.sort()
+        self.by_kind = {
+            kind: [k for k in self.keys if self.status[self.obs_id[k[2]]] in statuses]
+            for kind, statuses in self.kinds.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def first(self) -> str:
+        return self.obs_id[self.keys[0][2]] if self.keys else None
+
+    def offset(self, obs_id: str, n: int) -> str:
+        """observation_id n places from obs_id, None if out of range."""
+        i = bisect_left(self.keys, self.key[obs_id]) + n
+        return self.obs_id[self.keys[i][2]] if 0 <= i < len(self.keys) else None
+
+    def step(self, obs_id: str, n: int, kind: str = None) -> str:
+        """Move n observations of kind from obs_id, stopping at the ends."""
+        key = self.key[obs_id]
+        keys = self.by_kind.get(kind)
+        if keys is None:
+            i = bisect_left(self.keys, key) + n
+            i = max(0, min(i, len(self.keys) - 1))
+            return self.obs_id[self.keys[i][2]]
+        if n > 0:
+            i = bisect_right(keys, key)  # first of kind after obs_id
+            if i == len(keys):
+                return obs_id
+            i = min(i + n - 1, len(keys) - 1)
+        else:
+            i = bisect_left(keys, key) - 1  # last of kind before obs_id
+            if i < 0:
+                return obs_id
+            i = max(i + n + 1, 0)
+        return self.obs_id[keys[i][2]]
+
+    def following(self, obs_id: str, n: int, kind: str = None) -> list[str]:
+        """n observation_ids of kind starting from obs_id, or the next after it."""
+        keys = self.by_kind.get(kind, self.keys)
+        i = bisect_left(keys, self.key[obs_id])
+        return [self.obs_id[k[2]] for k in keys[i : i + n]]
+
+    def between(self, obs_id0: str, obs_id1: str, kind: str = None) -> list[str]:
+        """observation_ids of kind from obs_id0 to obs_id1 inclusive, either order."""
+        keys = self.by_kind.get(kind, self.keys)
+        start, end = sorted([self.key[obs_id0], self.key[obs_id1]])
+        return [
+            self.obs_id[k[2]]
+            for k in keys[bisect_left(keys, start) : bisect_right(keys, end)]
+        ]
+
+    def refresh(self, obs_id: str) -> None:
+        """Update obs_id's position and status after an edit or insert."""
+        row = self.con.execute(
+            KEY_QUERY + " where observation_id = ?", [obs_id]
+        ).fetchone()
+        old = self.key.pop(obs_id, None)
+        if old is not None:
+            self._remove(old, self.status.pop(obs_id))
+        if row is None:  # deleted
+            return
+        rowid, epoch, group_number, status, _ = row
+        key = sort_key(rowid, epoch, group_number)
+        self.key[obs_id] = key
+        self.obs_id[rowid] = obs_id
+        self.status[obs_id] = status
+        insort(self.keys, key)
+        for kind, statuses in self.kinds.items():
+            if status in statuses:
+                insort(self.by_kind[kind], key)
+
+    def _remove(self, key: tuple, status) -> None:
+        del self.keys[bisect_left(self.keys, key)]
+        del self.obs_id[key[2]]
+        for kind, statuses in self.kinds.items():
+            if status in statuses:
+                keys = self.by_kind[kind]
+                del keys[bisect_left(keys, key)]
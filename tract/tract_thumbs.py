@@ -0,0 +1,117 @@
+"""Thumbnail store for the image browser, kept in the image folder.
+
+Thumbnails are keyed by image_hash, so renaming or moving images doesn't
+invalidate them, and stored as <image folder>/.tract/thumbs/ab/abcd....jpg.
+Many trail cameras embed a small JPEG thumbnail in the EXIF data, that's used
+when it's big enough, otherwise the image is decoded at reduced scale with
+JPEG draft mode.  Reopening a project then never needs to decode full images
+just for the thumbnails.
+"""
+
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+import tract
+from tract_cache import CACHE_DIR
+from tract_images import THUMB_SIZE
+
+THUMB_DIR = "thumbs"  # in CACHE_DIR
+THUMB_QUALITY = 85
+EXIF_THUMB_MIN = 160  # smallest embedded thumbnail used, longest side
+
+
+def thumb_path(basedir: str, image_hash: str) -> Path:
+    return Path(basedir) / CACHE_DIR / THUMB_DIR / image_hash[:2] / f"{image_hash}.jpg"
+
+
+def make_thumbnail(path: str, size: tuple[int, int] = THUMB_SIZE) -> Image.Image:
+    """Thumbnail of the image at path, from EXIF if possible."""
+    with open(path, "rb") as img:
+        embedded = tract.exif_thumbnail(img.read(tract.EXIF_HEAD))
+    if embedded is not None:
+        try:
+            with Image.open(io.BytesIO(embedded)) as thumb:
+                if max(thumb.size) >= min(EXIF_THUMB_MIN, *size):
+                    thumb.thumbnail(size)
+                    return thumb.convert("RGB")
+        except OSError:  # corrupt embedded thumbnail, decode the image
+            pass
+    with Image.open(path) as img:
+        img.draft("RGB", size)  # JPEG only, decode at 1/2 - 1/8 scale
+        img.thumbnail(size)
+        return img.convert("RGB")
+
+
+def store_thumbnail(path: str, dest: Path) -> Image.Image:
+    """Make the thumbnail for path and write it to dest."""
+    thumb = make_thumbnail(path)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    # unique temp file, the prefetch and Tk threads may store the same thumbnail
+    fd, temp = tempfile.mkstemp(suffix=".tmp", dir=dest.parent)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            thumb.save(out, "JPEG", quality=THUMB_QUALITY)
+        os.replace(temp, dest)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return thumb
+
+
+def thumbnail(basedir: str, image_path: str, image_hash: str) -> Image.Image:
+    """Stored thumbnail for image_hash, made and stored if missing."""
+    path = Path(basedir) / image_path
+    if not image_hash:
+        return make_thumbnail(path)
+    dest = thumb_path(basedir, image_hash)
+    try:
+        with Image.open(dest) as thumb:
+            return thumb.copy()
+    except OSError:
+        pass
+    try:
+        return store_thumbnail(path, dest)
+    except OSError:  # e.g. read-only image folder or mount, as metadata_cache()
+        return make_thumbnail(path)
+
+
+def _store(args: tuple) -> bool:
+    """store_thumbnail() for a process pool, False if the image can't be read."""
+    try:
+        store_thumbnail(*args)
+        return True
+    except OSError:
+        return False
+
+
+def pregenerate(con, basedir: str, workers: int = None, progress=None) -> int:
+    """Store missing thumbnails for all images in imgdata, return number made."""
+    todo = {}
+    for image_path, image_hash in con.execute(
+        "select image_path, image_hash from imgdata "
+        "where image_hash is not null group by image_hash"
+    ):
+        dest = thumb_path(basedir, image_hash)
+        if not dest.exists():
+            todo[image_hash] = (Path(basedir) / image_path, dest)
+    start = time.time()
+    made = 0
+    pool = ProcessPoolExecutor(workers or tract.INGEST_WORKERS)
+    try:
+        for done, ok in enumerate(pool.map(_store, todo.values(), chunksize=16), 1):
+            made += ok
+            if progress:
+                progress(done, len(todo))
+    finally:  # don't make the rest if progress() raised Cancelled
+        pool.shutdown(cancel_futures=True)
+    print(
+        f"{made} thumbnails made, {len(todo) - made} failed, "
+        f"{time.time() - start:.1f} s"
+    )
+    return made
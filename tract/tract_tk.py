@@ -1,15 +1,25 @@
+import logging
+import multiprocessing
 import os
 import sys
+import threading
 import tkinter as tk
 import tkinter.ttk as ttk
+from functools import partial
 from pathlib import Path
 from tkinter import filedialog, messagebox
 from uuid import uuid4
 
-from dateutil.parser import parse
-from PIL import Image, ImageTk
+from PIL import ImageTk
 
 import tract
+import tract_analytics
+import tract_compare
+import tract_console
+import tract_images
+import tract_jobs
+import tract_nav
+import tract_thumbs
 
 
 class ScrollableFrame(ttk.Frame):
@@ -32,7 +42,9 @@ class ScrollableFrame(ttk.Frame):
 
 
 DEVMODE = os.environ.get("TRACT_DEVMODE")
-SQLPATH = ":memory:"
+AUTOSAVE_MS = 5 * 60 * 1000  # autosave interval
+EDIT_IDLE_MS = 700  # typing pause before edits are written, see edit()
+KEEP_STORE = not os.environ.get("TRACT_MEMORY_DB")  # default for working db option
 
 OBS_TYPES = {
     "All": None,
@@ -98,20 +110,33 @@ class TractUI:
 
     def __init__(self):
 
-        self.images = []  # list of images in time order
+        self.nav = None  # tract_nav.NavIndex of observations in time order
         self.con = None  # DB connection
-        # switch print() to console widget
+        self.store_persistent = False  # con is a working database file
+        self.saved_changes = 0  # con.total_changes at last save / autosave
+        self.autosave_thread = None
+        self.autosave_error = None
+        self.pending = {}  # observation_id: {field: value} not yet written
+        self.pending_after = None  # commit_edits() timer
+        self.form_schema = None  # tract.Schema the classification form shows
+        self.form_data = {}  # observation shown in the form
+        self.form = {}  # field name: function showing field from data
+        self.dropdowns = {}  # field name: Combobox
+        self.copy_data = None  # record from Copy, for the Paste buttons
+        self.range_start = None  # observation_id from Mark start
+        self.filling = False  # update_inputs() setting form values
+        self.vocab = None  # {field: set of values} for "previous" fields
+        self.image_cache = tract_images.ImageCache()
+        self.prefetcher = tract_images.Prefetcher(self.image_cache)
         self.stdout = sys.stdout
         self.stderr = sys.stderr
-        sys.stdout = self
-        if DEVMODE:
-            sys.stderr = self
         # Tk setup
         self.root = tk.Tk()
         self.style = ttk.Style()
         self.initialize()  # build UI
         # bind window closing callback
         self.root.protocol("WM_DELETE_WINDOW", self.exiting)
+        self.root.after(AUTOSAVE_MS, self.autosave)
         self.show_version()
         self.root.mainloop()
 
@@ -125,28 +150,23 @@ class TractUI:
         print("Couldn't find version.txt for version information")
 
     def exiting(self):
+        self.commit_edits()
         message = "OK to exit losing unsaved work,\nCancel to abort and save work"
+        if self.con is not None and self.store_persistent:
+            message = (
+                "OK to exit, unsaved work is kept in the working database,"
+                "\nCancel to abort and save work to the data file"
+            )
+        if self.jobs.busy:
+            message += "\n\nRunning background jobs will be cancelled."
         if messagebox.askokcancel(message, message):
+            self.jobs.cancel()
             self.root.destroy()
 
     def update_images(self):
-        """Loads list of image paths by date order"""
-        self.images = [
-            i[0]
-            for i in self.con.execute(
-                "select observation_id from imgdata "
-                "order by image_time, group_number asc"
-            )
-        ]
-
-    def write(self, text):
-        self.stdout.write(text)
-        self.stdout.write("\n")
-        # self.console.configure(state=tk.NORMAL)
-        self.console.insert(tk.END, text)
-        # self.console.configure(state=tk.DISABLED)
-        self.console.see(tk.END)
-        self.root.update()
+        """Rebuild the navigation index after loading / relinking images"""
+        self.nav = tract_nav.NavIndex(self.con, OBS_TYPES)
+        self.frm_classify.view.shown = None  # image paths may have changed
 
     def initialize(self):
         """layout gui, set up callbacks"""
@@ -163,6 +183,15 @@ class TractUI:
         # create this first so output to console works
         f = ttk.Frame()
         self.console = P(tk.Text(f), side="right", expand="yes", fill="both")
+        self.log = tract_console.Console(self.console)
+        # switch print() and logging to console widget, stderr as warnings
+        sys.stdout = tract_console.ConsoleStream(self.log, logging.INFO, self.stdout)
+        sys.stderr = tract_console.ConsoleStream(self.log, logging.WARNING, self.stderr)
+        logging.basicConfig(
+            level=logging.DEBUG if DEVMODE else logging.INFO,
+            format="%(levelname)s %(name)s: %(message)s",
+            handlers=[tract_console.ConsoleHandler(self.log)],
+        )
         self.nb.add(self.make_setup_frame(), text="File")
         self.nb.add(self.make_classify_frame(), text="Classify")
         # self.nb.add(self.make_tools_frame(), text="Tools")
@@ -174,6 +203,8 @@ class TractUI:
             self.save()
 
         P(ttk.Button(f, text="Save data to file", command=cb), anchor="nw", side="left")
+        self.jobs = tract_jobs.Jobs(f)
+        P(self.jobs.frame, anchor="nw", side="left")
         stack.add(f)
 
         if len(sys.argv) > 1:
@@ -184,25 +215,85 @@ class TractUI:
         print("Init. complete.")
 
     def save(self):
-        self.pre_save_update()
+        """Save from a snapshot in a background job, editing can continue"""
+        if self.con is None:
+            return
+        self.commit_edits()
+        con = self.con
         path = self.path_data.value.get()
-        tract.sqlite_to_xlsx(self.con, path)
-        print(f"Saved {path}")
-
-    def pre_save_update(self):
-        paths = [i[0] for i in self.con.execute("select image_path from imgdata")]
-        full_paths = [(self.absolute_path(i), i) for i in paths]
-        self.con.executemany(
-            "update imgdata set image_path_full = ? where image_path = ?", full_paths
+        snapshot = tract.snapshot(con)
+        changes = con.total_changes
+
+        def run(progress, basedir=self.path_pics.value.get()):
+            try:
+                tract.sqlite_to_data(snapshot, path, basedir)
+            finally:
+                snapshot.close()
+
+        def done(result):
+            if con is not self.con:
+                return
+            edited = con.total_changes != changes  # since snapshot
+            tract.mark_clean(con, path, dirty=edited)
+            self.saved_changes = changes if edited else con.total_changes
+            print(f"Saved {path}")
+
+        self.jobs.submit(f"Saving {Path(path).name}", run, done)
+
+    def autosave(self):
+        """Write a recovery copy from a snapshot in a worker thread, if changed.
+
+        The snapshot (SQLite backup API) is quick, writing the .xlsx happens
+        off the UI thread.  Recovery copies rotate, see tract.write_recovery().
+        """
+        self.root.after(AUTOSAVE_MS, self.autosave)
+        self.commit_edits()
+        if self.autosave_error is not None:
+            logging.warning(f"Autosave failed: {self.autosave_error}")
+            self.autosave_error = None
+        busy = self.autosave_thread is not None and self.autosave_thread.is_alive()
+        if self.con is None or busy or self.con.total_changes == self.saved_changes:
+            return
+        self.saved_changes = self.con.total_changes
+        path = self.path_data.value.get()
+        args = (
+            tract.snapshot(self.con),
+            path,
+            self.path_pics.value.get(),
+            tract.data_fields(path),
         )
 
+        def write(args=args):
+            try:
+                tract.write_recovery(*args)
+            except Exception as exc:  # reported by next autosave()
+                self.autosave_error = exc
+            finally:
+                args[0].close()
+
+        print(f"Autosaving to {tract.recovery_path(path)}")
+        self.autosave_thread = threading.Thread(target=write, daemon=True)
+        self.autosave_thread.start()
+
     def cb_load(self):
         path = self.path_data.value.get()
+        if self.jobs.busy:
+            print(f"Not loading {path}, wait for running jobs to finish.")
+            return
         print(f"Loading {path}")
-        self.con = tract.xlsx_to_sqlite(path, SQLPATH)
+        if self.con is not None:
+            self.commit_edits()
+            self.con.close()
+        self.store_persistent = self.keep_store.get()
+        self.con = tract.open_store(path, persistent=self.store_persistent)
+        self.vocab = None
+        self.saved_changes = self.con.total_changes
+        if DEVMODE:
+            for scan in tract.table_scans(self.con):
+                print(f"Table scan: {scan}")
         self.update_images()
         self.update_inputs()
-        print(f"Data loaded, {len(self.images)} records")
+        print(f"Data loaded, {len(self.nav)} records")
 
     def make_setup_frame(self):
         pad = dict(anchor="nw", side="top")
@@ -215,6 +306,16 @@ class TractUI:
         )
         self.path_data.value.set("SET THIS NEXT")
 
+        self.keep_store = tk.BooleanVar(value=KEEP_STORE)
+        P(
+            ttk.Checkbutton(
+                f,
+                text="Keep working database (.tract.db) beside data file",
+                variable=self.keep_store,
+            ),
+            **pad,
+        )
+
         def cb(value=self.path_data.value):
             text = filedialog.asksaveasfilename()
             if text:
@@ -226,32 +327,101 @@ class TractUI:
         P(ttk.Button(f, text="Create new data file", command=cb), **pad)
 
         def cb(self=self):
-            tract.check_new(self.con, self.path_pics.value.get())
+            run = partial(tract.check_new, self.con, self.path_pics.value.get())
+            self.jobs.submit("Checking for new images", run)
 
         P(ttk.Button(f, text="Check for new images", command=cb), **pad)
 
         def cb(path_pics=self.path_pics):
-            path = path_pics.value.get()
-            imgs = tract.image_list(path)
-            renames = tract.new_image_names(path, imgs)
-            print(f"{len(imgs)} images, {len(renames)} need renaming")
+            def run(progress, path=path_pics.value.get()):
+                imgs = tract.image_list(path)
+                renames = tract.new_image_names(path, imgs, progress=progress)
+                print(f"{len(imgs)} images, {len(renames)} need renaming")
+
+            self.jobs.submit("Checking image file names", run)
 
         P(ttk.Button(f, text="Check image file names", command=cb), **pad)
 
         def cb(path_pics=self.path_pics):
-            path = path_pics.value.get()
-            imgs = tract.image_list(path)
-            renames = tract.new_image_names(path, imgs, do_renames=True)
-            print(f"{len(imgs)} images, {len(renames)} renamed")
+            def run(progress, path=path_pics.value.get()):
+                imgs = tract.image_list(path)
+                renames = tract.new_image_names(
+                    path, imgs, do_renames=True, progress=progress
+                )
+                print(f"{len(imgs)} images, {len(renames)} renamed")
+
+            self.jobs.submit("Renaming images", run)
 
         P(ttk.Button(f, text="Rename images", command=cb), **pad)
 
         def cb(self=self):
-            tract.load_new(self.con, self.path_pics.value.get())
-            self.update_images()
+            run = partial(tract.load_new, self.con, self.path_pics.value.get())
+            self.jobs.submit("Loading new images", run, always=self.update_images)
 
         P(ttk.Button(f, text="Load new images", command=cb), **pad)
 
+        def cb(self=self):
+            other = filedialog.askopenfilename(title="Other coder's data file")
+            if not other:
+                return
+            report = filedialog.asksaveasfilename(
+                title="Comparison report",
+                defaultextension=".xlsx",
+                filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv")],
+            )
+            if not report:
+                return
+            self.commit_edits()
+
+            def run(progress, con=self.con):
+                other_con = tract.data_to_sqlite(other, ":memory:")
+                tract_compare.write_report(
+                    report, *tract_compare.compare(con, other_con)
+                )
+                print(f"Wrote comparison with {other} to {report}")
+
+            self.jobs.submit("Comparing data files", run)
+
+        P(ttk.Button(f, text="Compare with other data file", command=cb), **pad)
+
+        def cb(self=self):
+            summary = filedialog.asksaveasfilename(
+                title="Activity summary",
+                defaultextension=".xlsx",
+                filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv")],
+            )
+            if not summary:
+                return
+            self.commit_edits()
+
+            def run(progress, con=self.con):
+                return tract_analytics.summarize(con, summary)
+
+            self.jobs.submit("Summarizing activity", run)
+
+        P(ttk.Button(f, text="Activity summary", command=cb), **pad)
+
+        def cb(self=self):
+            def run(progress, con=self.con, path=self.path_pics.value.get()):
+                return tract.relink_images(con, path, progress=progress)
+
+            self.jobs.submit("Relinking moved images", run, always=self.update_images)
+
+        P(ttk.Button(f, text="Relink moved images", command=cb), **pad)
+
+        def cb(self=self):
+            tract.clear_cache(self.path_pics.value.get())
+
+        P(ttk.Button(f, text="Clear image cache", command=cb), **pad)
+
+        def cb(self=self):
+            def run(progress, con=self.con, path=self.path_pics.value.get()):
+                return tract_thumbs.pregenerate(con, path, progress=progress)
+
+            self.jobs.submit("Making thumbnails", run)
+
+        P(ttk.Button(f, text="Pre-generate thumbnails", command=cb), **pad)
+
         def cb(self=self):
             self.save()
 
@@ -291,21 +461,52 @@ class TractUI:
         return data
 
     def update_inputs(self):
+        """Show the current observation in the classification form"""
         data = self.observation_data(self.frm_classify.view.path)
+        if self.vocab is None or self.form_schema is not tract.schema():
+            self.load_vocab()
+        if self.form_schema is not tract.schema():
+            self.build_form()
+        self.form_data = data
+        self.filling = True  # not an edit, see render_entry()
+        try:
+            for show in self.form.values():
+                show(data)
+        finally:
+            self.filling = False
+        return data
+
+    def build_form(self):
+        """Build inputs for the fields once, update_inputs() fills them in"""
         rec = self.frm_classify.rec
         for item in rec.winfo_children():
             item.destroy()
-        if data:
-            for field in tract.field_defs()["fields"].values():
-                self.render(rec, field, data)
-        return data
+        self.form_schema = tract.schema()
+        self.form = {}
+        self.dropdowns = {}
+        for field in self.form_schema.fields.values():
+            self.render(rec, field)
+
+    def load_vocab(self):
+        """Values used so far for "previous" fields, kept up to date on edits"""
+        self.vocab = {}
+        for field in tract.schema().fields.values():
+            if field.get("previous"):
+                name = field["name"]
+                self.vocab[name] = {
+                    i[0]
+                    for i in self.con.execute(f"select distinct {name} from imgdata")
+                    if i[0]
+                }
+        for name, input in self.dropdowns.items():
+            input["values"] = self.dropdown_values(tract.schema().fields[name])
 
     def make_classify_frame(self):
         f = self.frm_classify = ttk.Frame()
 
         def cb(self=self):
             data = self.update_inputs()
-            print(data["image_path"], data["image_time"])
+            logging.debug("%s %s", data["image_path"], data["image_time"])
 
         f.input = ttk.Frame()
 
@@ -315,96 +516,212 @@ class TractUI:
         buttons = P(ttk.Frame(rhs), side="top")
 
         def cb_copy_data(self=self):
+            self.commit_edits()
             self.copy_data = self.observation_data(self.frm_classify.view.path)
 
         P(ttk.Button(buttons, text="Copy", command=cb_copy_data))
 
         def cb_paste_data(self=self):
-            cur = self.con.cursor()
-            tract.update_row(cur, self.frm_classify.view.path, self.copy_data)
+            self.commit_edits()
+            with tract.transaction(self.con):
+                tract.update_row(self.con, self.frm_classify.view.path, self.copy_data)
+            self.nav.refresh(self.frm_classify.view.path)
             self.update_inputs()
 
         P(ttk.Button(buttons, text="Paste", command=cb_paste_data))
 
         def cb_paste_plus_data(self=self):
-            cur = self.con.cursor()
-            tract.update_row(cur, self.frm_classify.view.path, self.copy_data)
-            idx = self.images.index(self.frm_classify.view.path) + 1
-            idx = min(idx, len(self.images) - 1)
-            self.frm_classify.view.path = self.images[idx]
-            print(self.frm_classify.view.path)
+            self.commit_edits()
+            with tract.transaction(self.con):
+                tract.update_row(self.con, self.frm_classify.view.path, self.copy_data)
+            self.nav.refresh(self.frm_classify.view.path)
+            self.frm_classify.view.path = self.nav.step(self.frm_classify.view.path, 1)
+            logging.debug(self.frm_classify.view.path)
             self.browser_show(self.frm_classify.view)
-            self.update_images()
             self.update_inputs()
 
         P(ttk.Button(buttons, text="Paste+", command=cb_paste_plus_data))
 
         def cb_paste_prev(self=self):
-            idx = self.images.index(self.frm_classify.view.path) - 1
-            prev = self.observation_data(self.images[idx])
-            cur = self.con.cursor()
-            tract.update_row(cur, self.frm_classify.view.path, prev)
+            self.commit_edits()
+            prev_id = self.nav.offset(self.frm_classify.view.path, -1)
+            if prev_id is None:
+                return
+            prev = self.observation_data(prev_id)
+            with tract.transaction(self.con):
+                tract.update_row(self.con, self.frm_classify.view.path, prev)
+            self.nav.refresh(self.frm_classify.view.path)
             self.update_inputs()
 
         P(ttk.Button(buttons, text="Paste Prev.", command=cb_paste_prev))
+        P(ttk.Button(buttons, text="Suggest groups", command=self.suggest_groups))
+
+        bulk = P(ttk.Frame(rhs), side="top")
+        count = tk.IntVar(value=10)
+        P(ttk.Spinbox(bulk, from_=2, to=10000, textvariable=count, width=6))
+
+        def showing(view=f.view):
+            """An observation is shown, so the bulk buttons have a reference"""
+            return self.nav is not None and view.path in self.nav.key
+
+        def cb_paste_next(self=self, view=f.view):
+            if not showing():
+                return
+            kind = view.kind.get()
+            self.paste_to(ids=self.nav.following(view.path, count.get(), kind))
+
+        P(ttk.Button(bulk, text="Paste to next N", command=cb_paste_next))
+
+        def cb_paste_group(self=self, view=f.view):
+            if not showing():
+                return
+            group_id = self.observation_data(view.path).get("group_id")
+            if group_id is None:
+                print("Image is not in a group")
+                return
+            self.paste_to(group_id=group_id)
+
+        P(ttk.Button(bulk, text="Paste to group", command=cb_paste_group))
+
+        def cb_mark_start(self=self, view=f.view):
+            if not showing():
+                return
+            self.range_start = view.path
+            print(f"Range starts at {self.observation_data(view.path)['image_path']}")
+
+        P(ttk.Button(bulk, text="Mark start", command=cb_mark_start))
+
+        def cb_paste_range(self=self, view=f.view):
+            if not showing():
+                return
+            if self.range_start not in self.nav.key:
+                print("Use Mark start first")
+                return
+            ids = self.nav.between(self.range_start, view.path, view.kind.get())
+            self.paste_to(ids=ids)
+
+        P(ttk.Button(bulk, text="Paste to range", command=cb_paste_range))
         return f
 
-    def render_show(self, outer, field, data, value, row):
+    def paste_to(self, ids=None, group_id=None):
+        """Paste the copied record into observations ids, or group group_id"""
+        if self.copy_data is None:
+            print("Use Copy first")
+            return
+        self.commit_edits()
+        if ids is None:
+            ids = [
+                i[0]
+                for i in self.con.execute(
+                    "select observation_id from imgdata where group_id = ?",
+                    [group_id],
+                )
+            ]
+        updated = tract.bulk_update(self.con, self.copy_data, ids=ids)
+        print(f"Pasted to {updated} images")
+        status = self.copy_data.get("observation_status")
+        for obs_id in ids:
+            if self.nav.status.get(obs_id) != status:
+                self.nav.refresh(obs_id)
+        self.update_inputs()
+
+    def suggest_groups(self):
+        """Dialog listing tract.suggest_groups() results to apply"""
+        if self.con is None:
+            return
+        self.commit_edits()
+        top = tk.Toplevel(self.root)
+        top.title("Suggested groups")
+        row = P(ttk.Frame(top), side="top", anchor="nw", fill="x")
+        P(ttk.Label(row, text="Max. seconds between images"), side="left")
+        gap = tk.IntVar(value=tract.GROUP_GAP)
+        P(ttk.Spinbox(row, from_=1, to=3600, textvariable=gap, width=6))
+        listing = P(
+            tk.Listbox(top, selectmode="extended", width=80, height=20),
+            side="top",
+            fill="both",
+            expand=True,
+        )
+        suggestions = []
+
+        def cb_find():
+            suggestions[:] = tract.suggest_groups(self.con, gap.get())
+            listing.delete(0, tk.END)
+            for suggestion in suggestions:
+                start = tract.epoch_datetime(suggestion.start)
+                end = tract.epoch_datetime(suggestion.end)
+                listing.insert(
+                    tk.END,
+                    f"{suggestion.camera_deploy or ''} {start:%Y-%m-%d %H:%M:%S}"
+                    f" - {end:%H:%M:%S}  {len(suggestion.ids)} images",
+                )
+            listing.selection_set(0, tk.END)
+            print(f"{len(suggestions)} groups suggested")
+
+        P(ttk.Button(row, text="Find", command=cb_find))
+
+        def cb_apply():
+            chosen = [suggestions[i].ids for i in listing.curselection()]
+            tract.apply_groups(self.con, chosen)
+            top.destroy()
+            self.update_inputs()
+
+        buttons = P(ttk.Frame(top), side="top", anchor="nw")
+        P(ttk.Button(buttons, text="Apply selected", command=cb_apply))
+        P(ttk.Button(buttons, text="Cancel", command=top.destroy))
+        cb_find()
+
+    def render_show(self, outer, field, row):
         P(ttk.Label(row, text=field["name"], width=15), side="left", anchor="e")
-        truncated = str(value)
-        if isinstance(value, str) and len(truncated) > 20:
-            truncated = truncated[:10] + "…" + truncated[-10:]
-        P(ttk.Label(row, text=truncated), side="left", anchor="nw")
+        label = P(ttk.Label(row), side="left", anchor="nw")
         if field["name"] == "group_number":
-            P(self.add_button(row, field, data), side="top", anchor="nw")
+            P(self.add_button(row), side="top", anchor="nw")
 
-    def render_dropdown(self, outer, field, data, value, row):
-        P(ttk.Label(row, text=field["name"], width=15), side="left", anchor="e")
+        def show(data, key=field["name"], label=label):
+            value = data.get(key)
+            truncated = str(value)
+            if isinstance(value, str) and len(truncated) > 20:
+                truncated = truncated[:10] + "…" + truncated[-10:]
+            label.configure(text=truncated)
+
+        return show
+
+    def dropdown_values(self, field):
         values = field.get("values", [])
         if field.get("previous"):
-            values = sorted(
-                set(values)
-                | set(
-                    i[0] or ""
-                    for i in self.con.execute(
-                        f"select distinct {field['name']} from imgdata"
-                    )
-                )
-            )
-            values = [i for i in values if i]
+            values = sorted(set(values) | self.vocab[field["name"]])
+        return [i for i in values if i]
+
+    def render_dropdown(self, outer, field, row):
+        P(ttk.Label(row, text=field["name"], width=15), side="left", anchor="e")
         input = P(
-            ttk.Combobox(row, values=values),
+            ttk.Combobox(row, values=self.dropdown_values(field)),
             side="left",
             anchor="nw",
         )
+        self.dropdowns[field["name"]] = input
 
-        def cb(event, self=self, data=data, key=field["name"], input=input):
-            print(key, input.get())
-            print(self.record_temp.get())
-            self.con.execute(
-                f"update imgdata set {key} = ? where observation_id = ?",
-                [input.get(), data["observation_id"]],
-            )
-            self.browser_show(self.frm_classify.view)
+        def cb(event, self=self, key=field["name"], input=input):
+            if self.form_data:
+                self.edit(self.form_data["observation_id"], key, input.get())
 
         input.bind("<<ComboboxSelected>>", cb)
         input.bind("<KeyRelease>", cb)
-        if value is not None:
-            input.set(str(value))
+        input.bind("<FocusOut>", lambda event: self.commit_edits())
+
+        def show(data, key=field["name"], input=input):
+            value = data.get(key)
+            input.set("" if value is None else str(value))
+
+        return show
 
-    def render_entry(self, outer, field, data, value, row):
+    def render_entry(self, outer, field, row):
         P(ttk.Label(row, text=field["name"], width=15), side="left", anchor="e")
-        self.record_temp = content = tk.StringVar()
-        if value is not None:
-            content.set(str(value))
+        content = tk.StringVar()
 
-        def cb(*args, self=self, data=data, key=field["name"], input=content):
-            print(key, input.get())
-            self.con.execute(
-                f"update imgdata set {key} = ? where observation_id = ?",
-                [input.get(), data["observation_id"]],
-            )
-            self.browser_show(self.frm_classify.view)
+        def cb(*args, self=self, key=field["name"], input=content):
+            if not self.filling and self.form_data:
+                self.edit(self.form_data["observation_id"], key, input.get())
             return True
 
         input = P(
@@ -415,26 +732,71 @@ class TractUI:
         input["textvariable"] = content
         # input.bind("<<KeyRelease>>", cb)
         content.trace_add("write", cb)
-
-    def render(self, outer, field, data):
+        input.bind("<FocusOut>", lambda event: self.commit_edits())
+
+        def show(data, key=field["name"], content=content):
+            value = data.get(key)
+            content.set("" if value is None else str(value))
+
+        return show
+
+    def edit(self, obs_id, key, value):
+        """Buffer an edit, written after EDIT_IDLE_MS without further edits."""
+        logging.debug("%s %s", key, value)
+        self.pending.setdefault(obs_id, {})[key] = value
+        if self.pending_after is not None:
+            self.root.after_cancel(self.pending_after)
+        self.pending_after = self.root.after(EDIT_IDLE_MS, self.commit_edits)
+        self.show_info(self.frm_classify.view)
+
+    def commit_edits(self):
+        """Write buffered edits, one UPDATE per observation."""
+        if self.pending_after is not None:
+            self.root.after_cancel(self.pending_after)
+            self.pending_after = None
+        if not self.pending or self.con is None:
+            return
+        pending, self.pending = self.pending, {}
+        with tract.transaction(self.con):
+            for obs_id, data in pending.items():
+                self.con.execute(
+                    tract.update_sql(tuple(data)), list(data.values()) + [obs_id]
+                )
+        vocab = self.vocab or {}
+        for obs_id, data in pending.items():
+            if "observation_status" in data:
+                self.nav.refresh(obs_id)
+            for key, value in data.items():
+                if key in vocab and value and value not in vocab[key]:
+                    vocab[key].add(value)
+                    if key in self.dropdowns:
+                        self.dropdowns[key]["values"] = self.dropdown_values(
+                            tract.schema().fields[key]
+                        )
+
+    def render(self, outer, field):
         if not field.get("show") and not field.get("input"):
             return
         row = P(ttk.Frame(outer), side="top", anchor="nw")
-        value = data.get(field["name"])
         if field.get("show"):
-            self.render_show(outer, field, data, value, row)
-        elif field.get("input"):
-            if field["name"] == "group_id":
-                P(self.make_related(outer, field, data), side="top", anchor="nw")
-            elif field.get("values") or field.get("previous"):
-                self.render_dropdown(outer, field, data, value, row)
-            else:
-                self.render_entry(outer, field, data, value, row)
-
-    def add_button(self, outer, field, data):
+            show = self.render_show(outer, field, row)
+        elif field["name"] == "group_id":
+            show = self.make_related(outer)
+            P(self.scroller, side="top", anchor="nw")
+        elif field.get("values") or field.get("previous"):
+            show = self.render_dropdown(outer, field, row)
+        else:
+            show = self.render_entry(outer, field, row)
+        self.form[field["name"]] = show
+
+    def add_button(self, outer):
         """Add a button to add a new group_number entry"""
 
-        def cb(field=field, data=data):
+        def cb():
+            self.commit_edits()
+            data = self.observation_data(self.frm_classify.view.path)
+            if not data:
+                return
             count = next(
                 self.con.execute(
                     "select count(*) from imgdata where image_path=?",
@@ -445,10 +807,11 @@ class TractUI:
             new["group_number"] = count + 1
             new["observation_id"] = uuid4().hex
             new["group_id"] = uuid4().hex
-            for field_name, field in tract.field_defs()["fields"].items():
-                if "clear_to" in field and field_name in new:
-                    new[field_name] = field["clear_to"]
-            tract.insert_row(self.con, new)
+            for field_name, clear_to in tract.schema().clear_to.items():
+                if field_name in new:
+                    new[field_name] = clear_to
+            with tract.transaction(self.con):
+                tract.insert_row(self.con, new)
             new = list(
                 self.con.execute(
                     "select observation_id from imgdata where image_path=? "
@@ -457,30 +820,27 @@ class TractUI:
                 )
             )
             self.frm_classify.view.path = new[-1][0]  # first field from last record
-            self.update_images()
+            self.nav.refresh(new[-1][0])
             self.update_inputs()
 
         return ttk.Button(outer, text="Add group", command=cb)
 
-    def make_related(self, outer, field, data):
-        res = self.con.execute(
-            "select * from imgdata where group_id = ? "
-            "order by image_time, group_number",
-            [data["group_id"]],
-        )
-        others = tract.named_tuples(res)
-
+    def make_related(self, outer):
+        """Related observations panel, returns function showing them for data"""
         P(ttk.Label(outer, text="Related observations"), side="top", anchor="nw")
-        self.scroller = P(ScrollableFrame(outer), side="top", anchor="nw")
+        self.scroller = ScrollableFrame(outer)
         f = self.scroller.scrollable_frame
 
         def cb():
+            if not self.form_data:
+                return
+            obs_id = self.form_data["observation_id"]
             top = tk.Toplevel(self.root)
             browser = P(self.make_browser(top, info=True), side="top", fill="x")
-            browser.path = data["observation_id"]
+            browser.path = obs_id
             self.browser_show(browser)
 
-            def cb(browser=browser, path=data["observation_id"]):
+            def cb(browser=browser, path=obs_id):
                 browser.path = path
                 self.browser_show(browser)
 
@@ -491,8 +851,9 @@ class TractUI:
                 expand="y",
             )
 
-            def cb(data=data, browser=browser, top=top, self=self):
-                tract.set_related(self.con, data["observation_id"], browser.path)
+            def cb(obs_id=obs_id, browser=browser, top=top, self=self):
+                self.commit_edits()
+                tract.set_related(self.con, obs_id, browser.path)
                 top.destroy()
                 self.update_inputs()
 
@@ -514,16 +875,30 @@ class TractUI:
             )
 
         P(ttk.Button(f, text="Add", command=cb), side="top")
+        lines = P(ttk.Frame(f), side="top", anchor="w")
 
-        if len(others) > 1:
+        def show(data, lines=lines):
+            for item in lines.winfo_children():
+                item.destroy()
+            if not data:
+                return
+            res = self.con.execute(
+                "select * from imgdata where group_id = ? "
+                "order by image_epoch, group_number",
+                [data["group_id"]],
+            )
+            others = tract.named_tuples(res)
+            if len(others) < 2:
+                return
             for other in others:
-                line = P(ttk.Frame(f), side="top", anchor="w")
+                line = P(ttk.Frame(lines), side="top", anchor="w")
                 P(ttk.Label(line, text=other.image_time), side="left")
 
                 if other.observation_id == data["observation_id"]:
                     P(ttk.Label(line, text="(this obs.)"), side="left")
 
                     def cb(self=self, data=other):
+                        self.commit_edits()
                         tract.unset_related(self.con, data.observation_id)
                         self.update_inputs()
 
@@ -534,6 +909,7 @@ class TractUI:
                 else:
 
                     def cb_jump(self=self, data=other):
+                        self.commit_edits()
                         self.frm_classify.view.path = data.observation_id
                         self.browser_show(self.frm_classify.view)
                         self.update_inputs()
@@ -543,7 +919,7 @@ class TractUI:
                         side="left",
                     )
 
-        return self.scroller
+        return show
 
     def relative_path(self, path):
         if not Path(path).is_absolute():
@@ -561,40 +937,18 @@ class TractUI:
             )
         )[0]
 
-    def advance_image_index(self, kind, idx, increment):
-        if not kind:
-            return idx + increment
-        kind = kind.get() or "All"
-        if OBS_TYPES[kind] is None:
-            return idx + increment
-        obs_status = list(
-            self.con.execute(
-                "select observation_id, observation_status "
-                "from imgdata order by image_time, group_number"
-            )
-        )
-        new_idx = idx
-        todo = abs(increment)
-        increment = 1 if increment > 0 else -1
-        in_bounds = lambda x: x >= 0 and x < len(obs_status)
-        while todo:
-            todo -= 1
-            new_idx += increment
-            while in_bounds(new_idx) and obs_status[new_idx][1] not in OBS_TYPES[kind]:
-                new_idx += increment
-            if not in_bounds(new_idx):
-                break
-            if obs_status[new_idx][1] in OBS_TYPES[kind]:
-                idx = new_idx
-
-        return idx
-
     def browser_show(self, view):
-        tn = Image.open(self.absolute_path(self.img_path(view.path)))
-        tn.thumbnail((1000, 1000))
+        if view.shown != view.path:
+            self.show_images(view)
+        self.show_info(view)
+
+    def show_images(self, view):
+        view.shown = view.path
+        tn = self.image_cache.get(
+            self.absolute_path(self.img_path(view.path)), tract_images.VIEW_SIZE
+        )
         view.pimg = ImageTk.PhotoImage(tn)
         view.img.configure(image=view.pimg)
-        idx = self.images.index(view.path)
         for item in view.tnails.winfo_children():
             item.destroy()
         tnail = [
@@ -604,29 +958,56 @@ class TractUI:
             (+1, "bottom", "se"),
         ]
         for tn_i, (offset, side, anchor) in enumerate(tnail):
-            if idx + offset < 0 or idx + offset > len(self.images) - 1:
+            other = self.nav.offset(view.path, offset)
+            if other is None:
                 continue
-            tnimg = P(
-                ttk.Label(view.tnails, text="Thumb"), side=side, anchor=anchor
-            )
-            path = self.images[idx + offset]
-            tn = Image.open(self.absolute_path(self.img_path(path)))
-            tn.thumbnail((200, 200))
+            tnimg = P(ttk.Label(view.tnails, text="Thumb"), side=side, anchor=anchor)
+            tn = self.image_cache.get(*self.thumbnail(other))
             tnimg.pimg = ImageTk.PhotoImage(tn)
             tnimg.configure(image=tnimg.pimg)
+        self.prefetch(view.path, view.direction)
 
+    def show_info(self, view):
         if view.info:
             data = self.observation_data(view.path)
+            data.update(self.pending.get(view.path, {}))
             # add day of week
-            data["_image_day_time"] = parse(data["image_time"]).strftime(
-                "%Y-%m-%d %A %H:%M:%S"
-            )
+            data["_image_day_time"] = data["image_time"]
+            if data.get("image_epoch") is not None:
+                data["_image_day_time"] = tract.epoch_datetime(
+                    data["image_epoch"]
+                ).strftime("%Y-%m-%d %A %H:%M:%S")
             view.info.configure(
                 text="{_image_day_time} Group: {group_number} "
                 "{adults_n}/{children_n}/ {pets_n} {direction} {activity} "
                 "({observation_status})".format_map(data)
             )
 
+    def prefetch(self, obs_id, direction):
+        """Decode the images likely to be shown next in the background."""
+        wanted = []
+        for step in range(1, tract_images.PREFETCH + 1):
+            other = self.nav.offset(obs_id, direction * step)
+            if other is not None:
+                path = self.absolute_path(self.img_path(other))
+                wanted.append((path, tract_images.VIEW_SIZE, None))
+            other = self.nav.offset(obs_id, direction * (step + 2))
+            if other is not None:
+                wanted.append(self.thumbnail(other))
+        self.prefetcher.request(wanted)
+
+    def thumbnail(self, obs_id):
+        """ImageCache.get() arguments for obs_id's thumbnail from the store."""
+        image_path, image_hash = next(
+            self.con.execute(
+                "select image_path, image_hash from imgdata where observation_id=?",
+                [obs_id],
+            )
+        )
+        basedir = self.path_pics.value.get()
+        load = partial(tract_thumbs.thumbnail, basedir, image_path, image_hash)
+        return self.absolute_path(image_path), tract_images.THUMB_SIZE, load
+
     def make_browser(self, outer, command=None, info=False, kind=False):
         nav = [
             (-9999, "|<"),
@@ -652,6 +1033,8 @@ class TractUI:
         )
 
         view.path = None
+        view.shown = None  # view.path whose images are shown
+        view.direction = 1  # of last navigation, for prefetch
 
         if info:
             view.info = P(ttk.Label(view, text="info"), side="top", anchor="nw")
@@ -673,13 +1056,14 @@ class TractUI:
         for n, text in nav:
 
             def cb(self=self, view=view, n=n, command=command, kind=view.kind):
+                self.commit_edits()
                 if view.path is None:
-                    view.path = self.images[0]
+                    view.path = self.nav.first()
+                    if view.path is None:
+                        return
                 else:
-                    idx = self.images.index(view.path)
-                    idx = self.advance_image_index(kind, idx, n)
-                    idx = max(0, min(idx, len(self.images) - 1))
-                    view.path = self.images[idx]
+                    view.path = self.nav.step(view.path, n, kind and kind.get())
+                view.direction = 1 if n > 0 else -1
                 self.browser_show(view)
                 if command:
                     command()
@@ -693,4 +1077,7 @@ class TractUI:
         return view
 
 
-TractUI()
+if __name__ == "__main__":
+    # process pool ingest workers re-import this module, see tract.add_images()
+    multiprocessing.freeze_support()
+    TractUI()